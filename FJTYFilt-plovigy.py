@@ -17,31 +17,62 @@ where the options are pairs as follows:
 -f <filename>    file to read (required)
 -c <coder>       optional coder identification (defaults to Parus Analytics)
 -a <filename>    optional name for autocoding lists
+-pf <number>     number of records read and prepared ahead of the one being coded (defaults to 16)
+-or <order>      order in which the records are presented: "file", "margin" or "rare" (defaults to file); see
+                 MODEL-ASSISTED ORDERING
+-md <dirname>    model directory (see modelFJML.py) used for -or; defaults to the pickled vectorizer and model
+-cp <filename>   pickled calibration written by FJTYFilt_estimator.py, used with the pickles
+-wf <filename>   wordlists of the stories, in the format produced by FJTYFilt_make_wordlists.py; stories which are not
+                 in the file are filtered with spaCy
+-rc <modes>      comma-delimited modes presented first with -or rare (defaults to 4,5,6)
 
 KEYS
 
 0-9       add mode to the record and write     
+Enter     add the predicted mode to the record and write (-or margin and -or rare only)
 +/space   skip: typically used when duplicates are recognized
 q         quit 
 
+MODEL-ASSISTED ORDERING
+
+With -or margin or -or rare, all of the stories in the file are classified in a single batch before the first record
+is displayed, and the records are presented in the order
+
+  margin : least confident first: the calibrated probability of the predicted mode if the model has a calibration,
+           otherwise the gap between the two largest SVM margins
+  rare   : the stories predicted as one of the -rc modes first, in the order the modes are given and most confident
+           first within each mode, followed by the rest of the file in file order
+
+The predicted mode and its confidence are shown with each story and Enter accepts it. The order is saved in 
+<filename>.order-<order>.json and reused when coding resumes, so the position recorded in FILEREC_NAME remains valid. 
+The stories are classified again if the model, calibration or wordlist file -- compared by size and modification time
+-- or, for -or rare, the -rc modes differ from the ones the order was made with, or if records have been appended to the 
+file; the records already coded keep their place at the start of the order. If the file has been rewritten, the saved
+record numbers no longer apply, so all of the stories are ranked again and coding restarts at the beginning of the 
+order.
+
 AUTOCODING 
 
 An autocoding file consists of a set of lines in the format
 
-  <mode#>-<mode_text>: <comma delimited list of phrases>
+  <mode#>-<mode_text>: [<window>:] <comma delimited list of phrases>
   
 Example:
 0-codeable-auto: Trump, Xi, WHO
 8-covid-19: coronavirus, covid-19, COVID-19
-3-gold-prices: Gold prices
+3-gold-prices: 32: Gold prices
 
-Autocoding checks the first AUTO_WINDOW characters in the text and if a phrase is found, the "mode" is set to <mode#>-<mode_text> 
-and the record is written without pausing. The lists are checked in order, so for example a text "Xi said China had the coronavirus
-under control" would have a mode of 0-codeable-auto, not 8-covid-19.
+Autocoding checks the first <window> characters in the text -- AUTO_WINDOW if the line does not give a window -- and if a 
+phrase is found, the "mode" is set to <mode#>-<mode_text> and the record is written without pausing. The lists are checked in 
+order, so for example a text "Xi said China had the coronavirus under control" would have a mode of 0-codeable-auto, not 
+8-covid-19. Blank lines and empty phrases are ignored.
 
 PROGRAMMING NOTES:
 
-1. The file FILEREC_NAME keeps track of the location in the file.
+1. The file FILEREC_NAME keeps track of the location in the file. The byte offset of each record is kept in the sidecar 
+   file <filename>.idx (see utilFJML.RecordIndex), so on restart the program seeks directly to the first record not
+   yet coded rather than reading the records before it. The index is built the first time a file is opened and
+   afterwards only records appended to the file are indexed.
 
 2. Output file names replaces "-stories" with "-labelled" and adds a time-stamp
 
@@ -51,11 +82,15 @@ PROGRAMMING NOTES:
    modify this to use other one-key alternatives, e.g. A, B, C,..., or if you are using a keypad, +, -, *, ... and then
    change the FJTYFilt_wordlists.py program to adjust for this.
    
-5. AUTO_WINDOW is currently a constant but it would be easy to modify the program so this could be set in the autofile lists,
-   e.g. something like
-            0-codeable-auto: 128: Trump, Xi, WHO
-            8-covid-19: 256: coronavirus, covid-19, COVID-19
-            3-gold-prices: 32: Gold prices
+5. The autocoding is done by utilFJML.AutoCoder, which compiles all of the phrases into a single trie-structured regex and finds the
+   first matching list in one pass over the start of the story, so the time per story does not grow with the number of
+   lists and phrases; only the first <window> characters of the story are joined. The same class can be used to 
+   autocode files outside of this program.
+
+6. The records are read, autocoded and, for those which are displayed, joined and wrapped in a prefetch thread which 
+   keeps PREFETCH records ahead of the one being coded, and the coded records are converted to JSON and written by a 
+   writer thread which flushes the output every FLUSH_INTERVAL seconds and on quitting, so the next screen appears
+   as soon as a key is pressed regardless of the size of the records.
  
 
 SYSTEM REQUIREMENTS
@@ -85,6 +120,13 @@ REVISION HISTORY:
 14-May-19:  Modified for PITF-PROT
 24-Jul-19:  Modified to use curses
 09-Mar-20:  Modified from plovigy-mark.py for FJTY system
+18-Oct-26:  Autocoding with utilFJML.AutoCoder; per-list windows
+18-Oct-26:  Coded fields set with utilFJML.set_coded_fields(), shared with FJTYFilt_autocode.py
+18-Oct-26:  Restart seeks to the first uncoded record using utilFJML.RecordIndex
+18-Oct-26:  Records prepared in a prefetch thread and written by a writer thread
+18-Oct-26:  Model-assisted ordering: -or, -md, -cp, -wf and -rc options
+18-Oct-26:  Saved order is checked against the model, wordlist file and -rc modes
+18-Oct-26:  Records appended to the file are ranked after the coded ones; a rewritten file restarts the order
 
 =========================================================================================================
 """
@@ -92,13 +134,17 @@ import sys
 sys.path.insert(1, "../FJ-2/")
 
 import utilFJML
+import modelFJML
+import threading
 import textwrap
 import curses
+import queue
 import json
+import time
 import os
 
 
-CMD_OPTIONS = ["-f", "-c", "-a"]
+CMD_OPTIONS = ["-f", "-c", "-a", "-pf", "-or", "-md", "-cp", "-wf", "-rc"]
 
 FJFILT_CATEGORIES = [("0", "codeable"), ("1", "sports"), ("2", "culture/entertainment"), ("3", "business/finance"), 
         ("4", "opinion"), ("5", "crime"), ("6", "accidents"), ("7", "natural disaster"), ("8", "[open]"), 
@@ -111,7 +157,125 @@ KEYOPTIONS = FIELDOPTIONS + " XQ+"
 
 CATEGORY_OFFSET = 7   # Y-axis negative offset for category list
 
-AUTO_WINDOW = 256  # number of characters to search for autoList phrases
+AUTO_WINDOW = 256  # default number of characters to search for autocoding phrases
+
+PREFETCH = 16        # number of records prepared ahead of the one being coded
+FLUSH_INTERVAL = 5   # seconds between flushes of the output file
+WRAP_WIDTH = 128     # characters per line of the displayed story
+
+DONE = None   # end-of-stream marker placed on the prefetch and output queues
+
+ORDER = "file"
+ORDER_OPTIONS = ["file", "margin", "rare"]
+RARE_MODES = [4, 5, 6]   # opinion, crime, accidents
+MODEL_DIR_NAME = None
+VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
+MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+CALIB_PFILE_NAME = None
+WORDLIST_FILE_NAME = None
+CHUNK_SIZE = 1024   # number of wordlists classified in each call to the model
+
+
+def get_wordlists(index):
+    """ returns the wordlist of each record in index: from WORDLIST_FILE_NAME if the record id is found there, 
+    otherwise by filtering the story with spaCy """
+    known = {}
+    if WORDLIST_FILE_NAME:
+        for rec in utilFJML.read_file(WORDLIST_FILE_NAME):
+            known.setdefault(rec["id"], rec["textInfo"]["wordlist"])
+    wordlists = [known.get(recid) for recid in index.ids]
+    missing = [ka for ka, wordlist in enumerate(wordlists) if wordlist is None]
+    if missing:
+        print("Filtering", len(missing), "stories with spaCy")
+        nlp = utilFJML.load_nlp("lean")
+        stories = ((utilFJML.get_story(rec), ka) for rec, ka in zip(index.get_records(missing), missing))
+        for doc, ka in nlp.pipe(stories, as_tuples=True):
+            wordlists[ka] = " ".join(utilFJML.get_wordlist(doc))
+    return wordlists
+
+
+def get_ranking(index):
+    """ returns [record number, predicted mode, confidence] for the records in index in the order they are presented """
+    if MODEL_DIR_NAME:
+        scorer = modelFJML.load_model(MODEL_DIR_NAME)
+    else:
+        scorer = modelFJML.load_pickles(VECTORZ_PFILE_NAME, MODEL_PFILE_NAME, CALIB_PFILE_NAME)
+    wordlists = get_wordlists(index)
+    print("Classifying", len(wordlists), "stories")
+    cases = []
+    for chunk in utilFJML.get_chunks(range(len(wordlists)), CHUNK_SIZE):
+        preds, margins, gaps, probs = scorer.predict_confidence([wordlists[ka] for ka in chunk])
+        confidence = gaps if probs is None else probs
+        cases.extend([ka, int(preds[kb]), round(float(confidence[kb]), 4)] for kb, ka in enumerate(chunk))
+    if ORDER == "margin":
+        return sorted(cases, key=lambda case: (case[2], case[0]))
+    rare = [case for case in cases if case[1] in RARE_MODES]
+    rare.sort(key=lambda case: (RARE_MODES.index(case[1]), -case[2], case[0]))
+    return rare + [case for case in cases if case[1] not in RARE_MODES]
+
+
+def get_fingerprint(path):
+    """ returns [name, size, modification time] of path, or of each of the files under path if it is a directory; None 
+    if path is None """
+    if not path:
+        return None
+    if os.path.isdir(path):
+        names = sorted(os.path.join(dirname, name) for dirname, _, names in os.walk(path) for name in names)
+    else:
+        names = [path] if os.path.exists(path) else []
+    return [[name, os.stat(name).st_size, os.stat(name).st_mtime_ns] for name in names]
+
+
+def get_ranking_settings():
+    """ returns the settings the ranking depends on: the model, calibration and wordlist files and, for -or rare, the 
+    -rc modes """
+    models = [MODEL_DIR_NAME] if MODEL_DIR_NAME else [VECTORZ_PFILE_NAME, MODEL_PFILE_NAME, CALIB_PFILE_NAME]
+    settings = {"model": [get_fingerprint(name) for name in models if name], 
+                "wordlists": get_fingerprint(WORDLIST_FILE_NAME)}
+    if ORDER == "rare":
+        settings["rare_modes"] = RARE_MODES
+    return settings
+
+
+def get_index_check(index, nrec):
+    """ returns [offset, id] of the first and last of the first nrec records in index, which locate them in the file """
+    return [[index.offsets[krec], index.ids[krec]] for krec in sorted({0, nrec - 1})] if nrec else []
+
+
+def load_ranking(index, ncoded):
+    """ returns the ranking of the records for ORDER and the number of records at its start which have already been 
+    coded. The saved ranking is used if it matches the file and the settings. If only records have been appended to 
+    the file or the settings have changed, the first ncoded records of the saved ranking keep their place, so the 
+    position in FILEREC_NAME remains valid, and the rest are ranked again. If the file has been rewritten, the record 
+    numbers in the saved ranking are no longer valid: all of the records are ranked and coding restarts at the 
+    beginning of the order """
+    rankname = filename + ".order-" + ORDER + ".json"
+    settings = get_ranking_settings()
+    coded = []
+    if os.path.exists(rankname):
+        with open(rankname, "r") as frank:
+            saved = json.load(frank)
+        changed = [key for key in settings if saved.get(key) != settings[key]]
+        check = get_index_check(index, min(saved["records"], len(index)))
+        if index.rebuilt or saved["records"] > len(index) or saved.get("check", check) != check:
+            print(filename, "has been rewritten: classifying the stories again and restarting at the beginning of",
+                  "the order")
+            ncoded = 0
+        elif saved["records"] == len(index) and not changed:
+            print("Using the order saved in", rankname)
+            return saved["cases"], ncoded
+        else:
+            coded = saved["cases"][:ncoded]
+            if saved["records"] != len(index):
+                changed.append(str(len(index) - saved["records"]) + " records added to " + filename)
+            print("Classifying the stories again:", ", ".join(changed), "since the order in", rankname, "was saved;",
+                  "the", len(coded), "records already coded keep their place")
+    done = {case[0] for case in coded}
+    cases = coded + [case for case in get_ranking(index) if case[0] not in done]
+    with open(rankname, "w") as frank:
+        json.dump(dict(settings, order=ORDER, records=len(index), check=get_index_check(index, len(index)),
+                       date=" ".join(utilFJML.get_date_time()), cases=cases), frank)
+    return cases, ncoded
 
 
 # process command line options
@@ -127,6 +291,18 @@ for cmdopt in sys.argv: # yes, I know there is also a massive package that can d
             coder = theopt
         elif cmdopt == "-a":
             autoFilename = theopt
+        elif cmdopt == "-pf":
+            PREFETCH = int(theopt)
+        elif cmdopt == "-or":
+            ORDER = theopt
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = theopt
+        elif cmdopt == "-cp":
+            CALIB_PFILE_NAME = theopt
+        elif cmdopt == "-wf":
+            WORDLIST_FILE_NAME = theopt
+        elif cmdopt == "-rc":
+            RARE_MODES = [int(mode) for mode in theopt.split(",")]
         """elif cmdopt == "-sp":
             STORY_PREFIX = theopt
         elif cmdopt == "-wp":
@@ -143,26 +319,28 @@ for cmdopt in sys.argv: # yes, I know there is also a massive package that can d
 if not filename: 
     print("File name (-f) is required")
     exit()
+
+if ORDER not in ORDER_OPTIONS:
+    print("The order (-or) must be one of", ", ".join(ORDER_OPTIONS))
+    exit()
+if ORDER != "file":
+    KEYOPTIONS += "\n"   # Enter accepts the predicted mode
     
 if autoFilename:
     if not os.path.exists(autoFilename):
         print("The autocoding file", autoFilename, "could not be found\nExiting program")
         exit()  
-    autoLists = []
-    for line in open(autoFilename,"r"):
-        part = line[:-1].partition(":")
-        autoLists.append((part[0],[li.strip() for li in part[2].split(",")]))
-
-#print(autoLists)
-#exit()
+    autocoder = utilFJML.AutoCoder(autoFilename, AUTO_WINDOW)
     
 nskip = 0
 if os.path.exists(FILEREC_NAME):  
     with open(FILEREC_NAME,'r') as frec:
         line = frec.readline() 
-        while line:  # go through the entire file to get the last entry
-            if filename in line:
-                nskip = int(line.split()[1])
+        while line:  # go through the entire file to get the last entry for this file and order
+            fields = line.split()
+            lineorder = ([field[6:] for field in fields if field.startswith("order:")] or ["file"])[0]
+            if fields[:1] == [filename] and lineorder == ORDER:
+                nskip = int(fields[1])
             line = frec.readline()
 
 if nskip < 0:
@@ -179,8 +357,60 @@ if nskip == 0:
 else:
     print("Skipping first", nskip - 1,"records in",filename)            
 
+index = utilFJML.RecordIndex(filename)
+if ORDER == "file":
+    reader = ((record, None) for record in index.read_from(nskip))
+else:
+    ranking, nskip = load_ranking(index, nskip)
+    reader = zip(index.get_records([case[0] for case in ranking[nskip:]]), (tuple(case) for case in ranking[nskip:]))
+
 answ = input("Press return to start...")
 
+def prefetch_records(reader, qout):
+    """ puts (position, record, prediction, autocoded mode, wrapped story) on qout for each (record, prediction) from 
+    reader; the story is only joined and wrapped for records which are not autocoded. An exception is passed to main() 
+    on the queue """
+    try:
+        for ka, (record, prediction) in enumerate(reader, nskip):
+            mode = autocoder.get_record_mode(record) if autoFilename else None
+            lines = None if mode else textwrap.wrap(" ".join(record["textInfo"]["textStory"]), WRAP_WIDTH)
+            qout.put((ka, record, prediction, mode, lines))
+    except Exception as err:
+        qout.put(err)
+    qout.put(DONE)
+
+
+def get_prefetched(qin):
+    """ generates the items from prefetch_records() """
+    while True:
+        item = qin.get()
+        if item is DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def write_records(qin, fout):
+    """ writes the records from qin to fout until DONE, flushing at least every FLUSH_INTERVAL seconds while records
+    are being written and when the queue is idle """
+    tflush = time.time()
+    while True:
+        try:
+            record = qin.get(timeout=FLUSH_INTERVAL)
+        except queue.Empty:
+            fout.flush()
+            tflush = time.time()
+            continue
+        if record is DONE:
+            fout.flush()
+            return
+        fout.write(json.dumps(record, indent=2, sort_keys=True ) + "\n")
+        if time.time() - tflush > FLUSH_INTERVAL:
+            fout.flush()
+            tflush = time.time()
+
+
 def main(stdscr):
 
     global nskip
@@ -220,43 +450,32 @@ def main(stdscr):
             
     def write_record(autocode = False):
         if autocode:
-            record["citeInfo"]['parser'] = "Mode autocoded in FJTYFilt-plovigy.py using " + autoFilename
+            utilFJML.set_coded_fields(record, "Mode autocoded in FJTYFilt-plovigy.py using " + autoFilename, coder)
         else:
-            record["citeInfo"]['parser'] = "Mode set using in FJTYFilt-plovigy.py"
-        record['codedDate'], record['codedTime'] = utilFJML.get_date_time()
-        record['coder'] = coder
-        fout.write(json.dumps(record, indent=2, sort_keys=True ) + "\n")
+            utilFJML.set_coded_fields(record, "Mode set using in FJTYFilt-plovigy.py", coder)
+        qwrite.put(record)
 
 
     nacc, nrej, nauto = 0, 0, 0  # counters for annotations
-    for ka, record in enumerate(reader):
-        if ka < nskip:
-            continue
-            
-        thestory = " ".join(record["textInfo"]["textStory"]) 
-        if autoFilename:
-            gotone = False
-            for li in autoLists:
-                for target in li[1]:
-                    if target in thestory[:AUTO_WINDOW]: 
-                       record["mode"] = li[0]
-                       write_record(autocode = True)
-                       nauto += 1
-                       gotone = True
-                       break
-                if gotone: 
-                    break
-            if gotone:
-                continue                        
+    for ka, record, prediction, mode, lines in get_prefetched(qprefetch):
+        if mode:
+            record["mode"] = mode
+            write_record(autocode = True)
+            nauto += 1
+            continue                        
 
         modwin = curses.newwin(SUBW_HGT ,SUBW_WID, 2, 2)
         modwin.border()         
         
         modwin.addstr(INIT_Y, INIT_X, str(ka) + ": " + record['date'] )
         modwin.addstr(INIT_Y+2, INIT_X,record['citeInfo']['title'])
+        if prediction:
+            krec, predmode, confidence = prediction
+            modwin.addstr(INIT_Y, INIT_X + 40, "Predicted: {:s}-{:s}   confidence: {:.3f}   record: {:d}   Enter: accept".format(
+                          FJFILT_CATEGORIES[predmode][0], FJFILT_CATEGORIES[predmode][1], confidence, krec))
         y_curs = INIT_Y + 4
         x_curs = INIT_X
-        for ln in textwrap.wrap(thestory,128):
+        for ln in lines:
             if y_curs >= SUBW_HGT - CATEGORY_OFFSET - 2:
                 modwin.addstr(y_curs, x_curs, ln[:-20] + " ...---TRUNCATED---")
                 break
@@ -273,6 +492,10 @@ def main(stdscr):
             nacc += 1
             record["mode"] = FJFILT_CATEGORIES[int(keych)][0] + "-" + FJFILT_CATEGORIES[int(keych)][1]
             write_record()
+        elif keych == "\n" and prediction:
+            nacc += 1
+            record["mode"] = FJFILT_CATEGORIES[prediction[1]][0] + "-" + FJFILT_CATEGORIES[prediction[1]][1]
+            write_record()
         elif " " == keych or " "  == keych:
             nrej += 1
         elif keych == "Q":
@@ -292,16 +515,24 @@ else:
     outfilename = "null-labelled-" + timestr + "-" + filename # alternative if name is not regular
 fout = open(outfilename, "w")
 
-reader = utilFJML.read_file(filename)
-nacc, nrej, nauto = curses.wrapper(main)
-
-fout.close()
+qprefetch, qwrite = queue.Queue(PREFETCH), queue.Queue()
+threading.Thread(target=prefetch_records, args=(reader, qprefetch), daemon=True).start()
+writer = threading.Thread(target=write_records, args=(qwrite, fout))
+writer.start()
+try:
+    nacc, nrej, nauto = curses.wrapper(main)
+finally:   # the records already coded are written even if the program fails
+    qwrite.put(DONE)
+    writer.join()
+    fout.close()
 
 with open(FILEREC_NAME,'a') as frec:  # record cases coded and current position in file
     frec.write("{:s} {:d} {:s} {:s}".format(filename, nskip, timestr,outfilename)) 
     frec.write( "  accept:{:3d}  reject:{:3d}  auto:{:3d}  total:{:3d}".format(nacc, nrej, nauto, nauto + nacc + nrej))
     if autoFilename:
         frec.write("  autoFilename:" + autoFilename)
+    if ORDER != "file":
+        frec.write("  order:" + ORDER)
     frec.write("\n")
 
 print("Finished")
@@ -0,0 +1,181 @@
+"""
+FJTYFilt_autocode.py
+
+Headless version of the autocoding in FJTYFilt-plovigy.py: applies the autocoding lists to complete -stories files in
+PLOVER data-exchange (PDE) format without the curses interface. The records matching a list are written with the
+"mode", "parser", "coder", "codedDate" and "codedTime" fields set as in FJTYFilt-plovigy.py; the remaining records are
+written unchanged to a residual -stories file which can be coded manually with FJTYFilt-plovigy.py.
+
+TO RUN PROGRAM:
+
+python3 FJTYFilt_autocode.py -a <filename> -f <filename> [optional command pairs]
+
+Command options occur in pairs -<option> <value>. -a and either -f or -fl are required
+
+    -a AUTO_FILE_NAME   : autocoding lists; see FJTYFilt-plovigy.py for the format
+    -f FILE_NAME        : -stories file to autocode
+    -fl FILE_LIST       : read a simple list of -stories file names, one name per line
+    -c CODER            : coder identification. Default: Parus Analytics
+    -w AUTO_WINDOW      : number of characters searched for lines which do not give a window. Default: 256
+    -j N_JOBS           : number of processes autocoding files. Default: the number of cores, at most the number of files
+    -o JSON_FILE_NAME   : also write the hit counts and timing as JSON. Default: do not write file
+
+For each input file, the output files replace "-stories" in the name with
+
+    -labelled-<timestamp>           : autocoded records, as in FJTYFilt-plovigy.py
+    -residual-<timestamp>-stories   : records not matching any list
+
+PROGRAMMING NOTES:
+
+1. The files are autocoded in a pool of N_JOBS processes, one file per task, so the speedup requires more than one
+   file; each process compiles the lists once when it starts. The output of a file does not depend on N_JOBS.
+
+2. The hit counts are reported for each line -- "rule" -- of the autocoding file, since a mode can appear on more than
+   one line. A record is counted only for the first line it matches. Rules are numbered in order, skipping blank lines;
+   "line" is the line number in the autocoding file.
+
+SYSTEM REQUIREMENTS
+This program has been successfully run under Ubuntu 20.04; it is standard Python 3.7 so it should also run in Windows.
+
+PROVENANCE:
+Programmer: Philip A. Schrodt
+            Parus Analytics
+            Charlottesville, VA, 22901 U.S.A.
+            http://eventdata.parusanalytics.com
+
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+Report bugs to: schrodt735@gmail.com
+
+REVISION HISTORY:
+18-Oct-26: Initial version
+18-Oct-26: hit report gives the line number of each rule in the autocoding file
+
+=========================================================================================================
+"""
+
+import sys
+sys.path.insert(1, "../FJ-2/")
+
+from concurrent.futures import ProcessPoolExecutor
+import utilFJML
+import json
+import time
+import os
+
+CMD_OPTIONS = ["-a", "-f", "-fl", "-c", "-w", "-j", "-o"]
+
+AUTO_FILE_NAME = None
+FILE_NAMES = []
+CODER = "Parus Analytics"
+AUTO_WINDOW = 256
+N_JOBS = None   # default: the number of cores, at most the number of files
+JSON_FILE_NAME = None
+
+
+def get_output_name(filename, label, timestr):
+    """ replaces "-stories" in filename with label and the time stamp, following FJTYFilt-plovigy.py """
+    if "-stories." in filename:
+        return filename.replace("-stories.", label + timestr + ".")
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, "null" + label + timestr + "-" + basename)
+
+
+def init_autocoder(autofile, window, coder, timestr):
+    """ compiles the autocoding lists used by the files autocoded in a process """
+    global autocoder, AUTO_FILE_NAME, CODER, suffix
+    autocoder = utilFJML.AutoCoder(autofile, window)
+    AUTO_FILE_NAME, CODER, suffix = autofile, coder, timestr
+
+
+def autocode_file(filename):
+    """ writes the autocoded and residual records of filename; returns the counts and timing """
+    result = {"file": filename, "labelled": get_output_name(filename, "-labelled-", suffix),
+              "residual": get_output_name(filename, "-residual-", suffix + "-stories"),
+              "cases": 0, "autocoded": 0, "hits": [0] * len(autocoder.lists)}
+    parser = "Mode autocoded in FJTYFilt_autocode.py using " + AUTO_FILE_NAME
+    t0 = time.time()
+    with open(result["labelled"], "w") as flab, open(result["residual"], "w") as fres:
+        for rec in utilFJML.read_file(filename):
+            result["cases"] += 1
+            klist = autocoder.get_record_index(rec)
+            if klist is None:
+                fres.write(json.dumps(rec, indent=2, sort_keys=True ) + "\n")
+                continue
+            rec["mode"] = autocoder.lists[klist][0]
+            utilFJML.set_coded_fields(rec, parser, CODER)
+            flab.write(json.dumps(rec, indent=2, sort_keys=True ) + "\n")
+            result["autocoded"] += 1
+            result["hits"][klist] += 1
+    result["time"] = time.time() - t0
+    return result
+
+
+if __name__ == "__main__":
+    for cmdopt in sys.argv:
+        if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+            theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+            if cmdopt == "-a":
+                AUTO_FILE_NAME = theopt
+            elif cmdopt == "-f":
+                FILE_NAMES = [theopt]
+            elif cmdopt == "-fl":
+                FILE_NAMES = [line[:-1] for line in open(theopt, "r") if line.strip()]
+            elif cmdopt == "-c":
+                CODER = theopt
+            elif cmdopt == "-w":
+                AUTO_WINDOW = int(theopt)
+            elif cmdopt == "-j":
+                N_JOBS = int(theopt)
+            elif cmdopt == "-o":
+                JSON_FILE_NAME = theopt
+        elif cmdopt.startswith('-'):
+            print("Unrecognized option: " + cmdopt, end=" ")
+            try:
+                print(sys.argv[sys.argv.index(cmdopt) + 1])
+            except:
+                print()
+
+    if not AUTO_FILE_NAME or not FILE_NAMES:
+        print("An autocoding file (-a) and a file name (-f) or file list (-fl) are required")
+        exit()
+    for filename in [AUTO_FILE_NAME] + FILE_NAMES:
+        if not os.path.exists(filename):
+            print("The file", filename, "could not be found\nExiting program")
+            exit()
+
+    timestr = utilFJML.get_timed_suffix()
+    init_autocoder(AUTO_FILE_NAME, AUTO_WINDOW, CODER, timestr)
+    N_JOBS = N_JOBS or min(os.cpu_count() or 1, len(FILE_NAMES))
+    print("Autocoding {:d} files in {:d} processes using {:s}".format(len(FILE_NAMES), N_JOBS, AUTO_FILE_NAME))
+    t0 = time.time()
+    if N_JOBS > 1:
+        with ProcessPoolExecutor(N_JOBS, initializer=init_autocoder,
+                                 initargs=(AUTO_FILE_NAME, AUTO_WINDOW, CODER, timestr)) as pool:
+            results = list(pool.map(autocode_file, FILE_NAMES))
+    else:
+        results = [autocode_file(filename) for filename in FILE_NAMES]
+    dt = max(time.time() - t0, 1e-9)
+
+    ncase, nauto = sum(res["cases"] for res in results), sum(res["autocoded"] for res in results)
+    for res in results:
+        print("{:s}: {:d} cases, {:d} autocoded, {:d} residual in {:.2f} sec: {:.1f} cases/sec".format(res["file"],
+              res["cases"], res["autocoded"], res["cases"] - res["autocoded"], res["time"],
+              res["cases"] / max(res["time"], 1e-9)))
+        print("    " + res["labelled"] + "\n    " + res["residual"])
+    print("\nHits by rule\n{:>4s} {:>5s}  {:<24s} {:>6s} {:>8s}  {:>7s}".format("rule", "line", "mode", "window", "hits", "percent"))
+    rules = []
+    for klist, (mode, window, phrases) in enumerate(autocoder.lists):
+        nhit = sum(res["hits"][klist] for res in results)
+        rules.append({"rule": klist + 1, "line": autocoder.linenos[klist], "mode": mode, "window": window, "hits": nhit})
+        print("{:4d} {:5d}  {:<24s} {:6d} {:8d}  {:6.2f}%".format(klist + 1, autocoder.linenos[klist], mode, window, nhit,
+              nhit * 100 / max(ncase, 1)))
+    print("Total: {:d} cases, {:d} autocoded ({:.2f}%), {:d} residual in {:.2f} sec: {:.1f} cases/sec".format(ncase,
+          nauto, nauto * 100 / max(ncase, 1), ncase - nauto, dt, ncase / dt))
+
+    if JSON_FILE_NAME:
+        with open(JSON_FILE_NAME, "w") as fout:
+            json.dump({"run": " ".join(utilFJML.get_date_time()), "autocode_file": AUTO_FILE_NAME,
+                       "window": AUTO_WINDOW, "coder": CODER, "jobs": N_JOBS, "cases": ncase, "autocoded": nauto,
+                       "time": dt, "rules": rules, "files": results}, fout, indent=2, sort_keys=True)
+    print("Finished")
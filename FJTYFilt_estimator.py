@@ -6,13 +6,64 @@ then saves these
 
 TO RUN PROGRAM:
 
-python3 SVM_filter_estimate.py 
+python3 FJTYFilt_estimator.py [optional command pairs]
+
+Command options occur in pairs -<option> <value>.
+
+    -hv N_FEATURES      : use a HashingVectorizer with N_FEATURES columns followed by a TfidfTransformer rather than a 
+                          TfidfVectorizer, so the size of the model does not depend on the vocabulary. Default: TfidfVectorizer
+    -mdf MIN_DF         : TfidfVectorizer: ignore words found in fewer than MIN_DF cases. Default: 1
+    -mf MAX_FEATURES    : TfidfVectorizer: only keep the MAX_FEATURES most frequent words. Default: no limit
+    -cd N_CASES         : check that fitting the final model on the sparse tf/idf matrix of the first N_CASES cases (0 for
+                          all of them) gives the same coefficients as fitting it on the equivalent dense matrix
+    -vp VECTORZ_PFILE_NAME, -mp MODEL_PFILE_NAME, -md MODEL_DIR_NAME : output names for the pickled vectorizer, pickled
+                          model and model directory. Defaults: save-vectorizer-Mk2.p, save-lin_clf-Mk2.p, FJTY_Model-Mk2
+    -cp CALIB_PFILE_NAME: output name for the pickled calibration. Default: save-calib-Mk2.p
+    -s SEED             : seed for the train/test splits; the same seed gives the same splits. Default: 0
+    -j N_JOBS           : number of processes running the experiments. Default: the number of cores, at most N_EXPERIMENTS
+                          except in a grid search
+    -gs SEARCH_DIR      : grid search: rather than estimating a model, fit LinearSVC with each combination of the 
+                          SEARCH_C, SEARCH_CLASS_WEIGHT, SEARCH_LOSS and -- except with -hv -- SEARCH_MIN_DF settings to
+                          the N_EXPERIMENTS splits, caching the tf/idf matrices of the splits in SEARCH_DIR 
+    -gc C_VALUES        : comma-delimited list of the C values in the grid search. Default: 0.01,0.03,0.1,0.3,1,3,10
 
 
 PROGRAMMING NOTES:
 
-1. There are no summary statistics across the experiments, as these are currently just eyeballed to make sure nothing is 
-   badly out of line.
+1. The experiments run in a pool of N_JOBS processes. Each uses a stratified split -- TRAIN_PROP of the cases of each
+   mode -- drawn with random.Random(SEED + kex), so the results can be reproduced, and the experiments are reported in 
+   order once all of them have finished, followed by the mean, standard deviation, minimum and maximum across the 
+   experiments of the test accuracy for each category and overall. Timings are affected by the other experiments 
+   running at the same time: use -j 1 to compare them.
+
+2. Each experiment reports the test accuracy along with the number of features, the size of the pickled vectorizer and
+   model, and the time to load them, so the -hv, -mdf and -mf settings can be compared. The classification matrices,
+   precision/recall/F1 and summary statistics come from evalFJML.py, and are also written as JSON to a .json file 
+   with the same name as the text results so runs can be compared over time.
+
+3. The cases are read once. The term counts of all of the cases are computed once with a CountVectorizer (or the
+   HashingVectorizer) and each experiment only selects its training rows and vocabulary from this matrix and refits 
+   the idf weights, which gives the same tf/idf matrices as fitting a new TfidfVectorizer to the training cases.
+
+4. The tf/idf matrices are kept in sparse CSR format throughout: LinearSVC is fitted and predicts directly from these.
+   The size of each matrix, the size of the equivalent dense matrix and the peak memory use of the process are 
+   reported after each stage.
+
+5. The grid search saves the training and test tf/idf matrices of each split and min_df in SEARCH_DIR, under a name
+   which is a hash of the files and settings, so later searches with other C, class_weight or loss values start
+   from the saved matrices. Each process fits all of the C values for one split, class_weight and loss in 
+   ascending order of C to the same loaded matrices: liblinear, which LinearSVC uses, has no warm start, so the 
+   solution of one C value cannot be used as the starting point of the next. The mean test scores over the splits
+   are reported for each setting, along with the Pareto front of the settings for which no other setting has at 
+   least the same accuracy with no larger model -- vocabulary, idf and coefficients -- and no longer fit time. The 
+   results are also written to SEARCH_RESULT_FILE_NAME as text and JSON.
+
+6. The margins of the test cases of all of the experiments are used to fit a sigmoid calibration of the margins of
+   each class (see modelFJML.fit_calibration()), which is saved in CALIB_PFILE_NAME and the model directory and gives
+   the calibrated probabilities used by the -th option of FJTYFilt_evaluate.py. The test cases are grouped by their 
+   calibrated probability to show how well this matches their accuracy. These margins come from models estimated on 
+   TRAIN_PROP of the cases, so the probabilities from the final model, estimated on all of them, are likely to be 
+   somewhat conservative.
    
 
 SYSTEM REQUIREMENTS
@@ -36,6 +87,14 @@ REVISION HISTORY:
 31-Jan-17:	modified to save vectorizer and model, clean up output
 02-Jan-17:	cmd-line for file list; save estimates
 05-Mar-19:  modified from SVM_filter_estimate.py for FJ project
+18-Oct-26:  also save the model as NumPy arrays in MODEL_DIR_NAME
+18-Oct-26:  hashing vectorizer and vocabulary pruning options; model size report
+18-Oct-26:  sparse training and prediction; memory report; -cd option
+18-Oct-26:  read and count the cases once for all experiments
+18-Oct-26:  parallel experiments with seeded stratified splits; summary statistics
+18-Oct-26:  scores and reports from evalFJML.py; JSON copy of the results
+18-Oct-26:  grid search with cached tf/idf matrices: -gs, -gc options
+18-Oct-26:  calibration of the margins; -cp option
 
 =========================================================================================================
 """
@@ -43,13 +102,29 @@ REVISION HISTORY:
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.feature_extraction.text import TfidfTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.pipeline import make_pipeline
 from sklearn import svm
+from sklearn.exceptions import ConvergenceWarning
+from concurrent.futures import ProcessPoolExecutor
 from time import time
 import datetime
 import utilFJML
+import modelFJML
+import evalFJML
 import pickle
+import json
+import hashlib
+import warnings
+import scipy.sparse
+import numpy as np
 import random
+import sys
 import os
+try:
+    import resource   # Unix only: used for the peak memory in the memory report
+except ImportError:
+    resource = None
 
 N_EXPERIMENTS = 5
 TRAIN_PROP = 0.33   # proportion of cases in the training file.
@@ -58,153 +133,445 @@ INPUT_FILELIST = "filt-estimator-filelist.txt"
 FILE_PATH = "../FJML-Filter/FJTY_training_wordlists"
 FILE_NAMES = [line[:-1] for line in open(INPUT_FILELIST, "r")]
 
-LABELS = ["codeable", "sports", "culture/entertainment", "business/finance", "opinion", "crime", "accidents", 
-        "natural disaster", "open", "no codeable content"]
-
 TEST_RESULT_FILE_NAME = "SVM_test_results-"
+SEARCH_RESULT_FILE_NAME = "SVM_search_results-"
 VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
 MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+CALIB_PFILE_NAME = "save-calib-Mk2.p"   # calibration of the margins: see modelFJML.fit_calibration()
+MODEL_DIR_NAME = "FJTY_Model-Mk2"   # vectorizer and model as NumPy arrays: see modelFJML.py
 
 N_MODE = 10  # maximum number of unique modes
 
-random.seed()
-# Evaluate the model 
+CMD_OPTIONS = ["-hv", "-mdf", "-mf", "-cd", "-vp", "-mp", "-md", "-cp", "-s", "-j", "-gs", "-gc"]
+
+N_HASH_FEATURES = None
+MIN_DF = 1
+MAX_FEATURES = None
+N_CHECK_CASES = None
+SEED = 0
+N_JOBS = None   # default: the number of cores, at most N_EXPERIMENTS for the experiments
+
+SEARCH_DIR = None   # grid search: directory for the cached tf/idf matrices of each fold
+SEARCH_C = [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0]
+SEARCH_CLASS_WEIGHT = [None, "balanced"]
+SEARCH_LOSS = ["squared_hinge", "hinge"]
+SEARCH_MIN_DF = [1, 2, 5]   # TfidfVectorizer only: with -hv the number of features is fixed
+
+
+def get_vectorizer():
+    """ returns an unfitted vectorizer with the command-line settings """
+    if N_HASH_FEATURES:
+        return make_pipeline(HashingVectorizer(n_features=N_HASH_FEATURES, alternate_sign=False, norm=None), TfidfTransformer())
+    else:
+        return TfidfVectorizer(min_df=MIN_DF, max_features=MAX_FEATURES)
 
-suffix = utilFJML.get_timed_suffix()
-fout = open(TEST_RESULT_FILE_NAME + suffix + ".txt", 'w')
-fout.write("SVM_FILTER_ESTIMATE.PY TRAIN/TEST RESULTS\nRun datetime: {:s}\n".format(datetime.datetime.now().strftime('%y-%m-%d %H:%M:%S')))
-fout.write("Training cases proportion: {:0.3f}\nTraining files\n".format(TRAIN_PROP))
-fout.write("FILE_PATH: " + FILE_PATH + "\n")
-for stnm in FILE_NAMES:
-    fout.write("  " + stnm + '\n')
 
-for kex in range(N_EXPERIMENTS):
-    fout.write("\n       ============ Experiment {:d} ============\n".format(kex + 1))    
+def get_counter():
+    """ returns an unfitted vectorizer which produces the term counts used by get_vectorizer() """
+    if N_HASH_FEATURES:
+        return HashingVectorizer(n_features=N_HASH_FEATURES, alternate_sign=False, norm=None)
+    else:
+        return CountVectorizer()
+
+
+def read_corpus():
+    """ returns the modes and wordlists of all of the cases in FILE_NAMES """
     Y = []
     corpus = []
-    Ytest = []
-    testcase = []
-
     for filename in FILE_NAMES:
         reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
         print("Reading", FILE_PATH + filename)
         for krec, rec in enumerate(reader):
-            if random.random() < TRAIN_PROP:
-                Y.append(int(rec['mode'][0]))
-                corpus.append(rec['textInfo']['wordlist'])
-            else:
-                Ytest.append(int(rec['mode'][0]))
-                testcase.append(rec['textInfo']['wordlist'])
-
-    vectorizer = TfidfVectorizer(min_df=1)
-    tfidf2 = vectorizer.fit_transform(corpus)
-    X = tfidf2.toarray()
-
+            Y.append(int(rec['mode'][0]))
+            corpus.append(rec['textInfo']['wordlist'])
+    return np.array(Y), corpus
+
+
+def get_split(Xcounts, train, test, min_df=None):
+    """ returns the training and test tf/idf matrices, vocabulary and idf transformer for the rows train and test of 
+    Xcounts: this is the same as fitting get_vectorizer() to the training cases and transforming the test cases. 
+    min_df overrides MIN_DF """
+    min_df = MIN_DF if min_df is None else min_df
+    Xtrain = Xcounts[train]
+    if N_HASH_FEATURES:
+        cols = np.arange(Xcounts.shape[1])
+        vocabulary = None
+    else:
+        dfs = np.bincount(Xtrain.indices, minlength=Xcounts.shape[1])
+        cols = np.flatnonzero(dfs > 0)   # the vocabulary of the training cases
+        mask = dfs[cols] >= min_df
+        if MAX_FEATURES is not None and mask.sum() > MAX_FEATURES:   # as in CountVectorizer._limit_features()
+            tfs = np.asarray(Xtrain[:, cols].sum(axis=0)).ravel()
+            mask_inds = (-tfs[mask]).argsort()[:MAX_FEATURES]
+            new_mask = np.zeros(len(cols), dtype=bool)
+            new_mask[np.where(mask)[0][mask_inds]] = True
+            mask = new_mask
+        cols = cols[mask]
+        vocabulary = {term: kcol for kcol, term in enumerate(terms[cols])}
+    transformer = TfidfTransformer()
+    X = transformer.fit_transform(Xtrain[:, cols])
+    return X, transformer.transform(Xcounts[test][:, cols]), vocabulary, transformer
+
+
+def init_experiment(counts, modes, vocab):
+    """ sets the count matrix, modes and terms shared by the experiments run in a process """
+    global Xcounts, Yall, terms
+    Xcounts, Yall, terms = counts, modes, vocab
+
+
+def get_stratified_split(kex):
+    """ returns the sorted training and test rows for experiment kex: TRAIN_PROP of the cases of each mode, chosen with
+    random.Random(SEED + kex) so the split does not depend on the process or the order the experiments run in """
+    rng = random.Random(SEED + kex)
+    intrain = np.zeros(len(Yall), dtype=bool)
+    for mode in range(N_MODE):
+        rows = np.flatnonzero(Yall == mode).tolist()
+        rng.shuffle(rows)
+        intrain[rows[:int(round(TRAIN_PROP * len(rows)))]] = True
+    return np.flatnonzero(intrain), np.flatnonzero(~intrain)
+
+
+def run_experiment(kex):
+    """ estimates the model on the training rows of experiment kex and classifies the training and test rows; returns
+    a dictionary of the classification matrices, timings and model size which is reported by the parent process """
+    result = {"memory": []}
+    train, test = get_stratified_split(kex)
+    X, X_test, vocabulary, transformer = get_split(Xcounts, train, test)
+    result["memory"].append(get_memory("training tf/idf", X))
     t0 = time()
-    lin_clf = svm.LinearSVC()
-    lin_clf.fit(X, Y) 
-    print("Time to estimate: {:0.3f} sec".format(time() - t0))
-    fout.write("Time to estimate: {:0.3f} sec\n".format(time() - t0))
+    lin_clf = svm.LinearSVC(random_state=SEED + kex)
+    lin_clf.fit(X, Yall[train]) 
+    result["fit_time"] = time() - t0
+    result["memory"].append(get_memory("estimate"))
     """LinearSVC(C=1.0, class_weight=None, dual=True, fit_intercept=True,
          intercept_scaling=1, loss='squared_hinge', max_iter=1000,
          multi_class='ovr', penalty='l2', random_state=None, tol=0.0001,
          verbose=0)"""
-    #dec = lin_clf.decision_function([[1,1]])
-    kcorr = 0
-    classmat = []
-    for ka in range(N_MODE):
-        classmat.append(N_MODE*[0])
-    for ka, xv in enumerate(X):
-        pred = lin_clf.predict([xv])
-        classmat[Y[ka]][pred[0]] +=1
-        if Y[ka] == pred[0]:
-            kcorr +=1
-    print('Training set')
-    fout.write('Training set\n')
-    for ka, kv in enumerate(classmat):
-        print(ka,end=' | ')
-        fout.write(str(ka) + ' | ')
-        tot = 0
-        for kb, num in enumerate(kv):
-            print("{:4d}  ".format(num),end='')
-            fout.write("{:4d}  ".format(num))
-            tot += num
-            if ka == kb:
-                main = num
-        if tot > 0:
-            print('  {:.2f}'.format(float(main*100)/tot))
-            fout.write('  {:.2f}\n'.format(float(main*100)/tot))
-        else:
-            print('  {:.2f}'.format(0.0))
-            fout.write('  {:.2f}\n'.format(0.0))
-
-    X_test = vectorizer.transform(testcase).toarray()
-
-    kt = 0
-    kcorr = 0
-    classmat = []
-    for ka in range(N_MODE):
-        classmat.append(N_MODE*[0])
+    result["train_mat"], dt = evalFJML.evaluate(lin_clf, X, Yall[train], N_MODE)
+    result["memory"].append(get_memory("test tf/idf", X_test))
+    result["test_mat"], result["predict_time"] = evalFJML.evaluate(lin_clf, X_test, Yall[test], N_MODE)
+    result["test_margins"], result["test_modes"] = lin_clf.decision_function(X_test), Yall[test]
+    result["classes"] = lin_clf.classes_
+    result["nfeatures"] = X.shape[1]
+    result["nbytes"], result["tload"] = get_model_size((vocabulary, transformer), lin_clf)
+    return result
+
+
+def get_fold_name(kex, min_df):
+    """ returns the path, without extension, of the cached tf/idf matrices of experiment kex: the name is a hash of 
+    everything which affects the matrices, so a change in the files or settings gives a new cache entry """
+    files = [(filename, os.path.getsize(os.path.join(FILE_PATH, filename)), os.path.getmtime(os.path.join(FILE_PATH, filename)))
+             for filename in FILE_NAMES]
+    key = json.dumps([FILE_PATH, files, TRAIN_PROP, SEED, kex, N_HASH_FEATURES, min_df, MAX_FEATURES])
+    return os.path.join(SEARCH_DIR, "fold-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+
+
+def cache_fold(kex, min_df):
+    """ saves the training and test tf/idf matrices and modes of experiment kex in SEARCH_DIR unless they are already 
+    there; returns the path of the fold and whether it was computed """
+    foldname = get_fold_name(kex, min_df)
+    if os.path.exists(foldname + ".npz"):
+        return foldname, False
+    train, test = get_stratified_split(kex)
+    X, X_test, vocabulary, transformer = get_split(Xcounts, train, test, min_df)
+    scipy.sparse.save_npz(foldname + "-train.npz", X, compressed=False)
+    scipy.sparse.save_npz(foldname + "-test.npz", X_test, compressed=False)
+    # written last, so it only exists for a complete fold
+    np.savez(foldname + ".npz", Y=Yall[train], Ytest=Yall[test], vectorizer_bytes=len(pickle.dumps((vocabulary, transformer))))
+    return foldname, True
+
+
+def run_search(task):
+    """ fits the models for each of the SEARCH_C values, in ascending order, with the class_weight and loss of task to 
+    one cached fold and returns their test scores. liblinear cannot warm-start, so the C values share the loaded 
+    matrices rather than the solution. The model size is that of the pickled vocabulary and idf weights plus the 
+    coefficients, which does not depend on the pickle overhead of the settings """
+    foldname, kex, min_df, class_weight, loss = task
+    X = scipy.sparse.load_npz(foldname + "-train.npz")
+    X_test = scipy.sparse.load_npz(foldname + "-test.npz")
+    with np.load(foldname + ".npz") as fold:
+        Y, Ytest, vbytes = fold["Y"], fold["Ytest"], int(fold["vectorizer_bytes"])
+    results = []
+    for C in sorted(SEARCH_C):
+        with warnings.catch_warnings(record=True) as warns:
+            warnings.simplefilter("always", ConvergenceWarning)
+            t0 = time()
+            lin_clf = svm.LinearSVC(C=C, class_weight=class_weight, loss=loss, random_state=SEED + kex)
+            lin_clf.fit(X, Y)
+            fit_time = time() - t0
+        scores = evalFJML.get_scores(evalFJML.evaluate(lin_clf, X_test, Ytest, N_MODE)[0])
+        results.append({"C": C, "class_weight": class_weight, "loss": loss, "min_df": min_df, "fold": kex, 
+                        "accuracy": scores["accuracy"], "macro_f1": scores["macro_f1"], 
+                        "recall": [cls["recall"] for cls in scores["classes"]], "features": X.shape[1], 
+                        "model_bytes": vbytes + lin_clf.coef_.nbytes + lin_clf.intercept_.nbytes, "fit_sec": fit_time,
+                        "converged": not any(issubclass(warn.category, ConvergenceWarning) for warn in warns)})
+    return results
+
+
+def get_pareto(points):
+    """ returns the indices of the points which are not dominated: no other point has an accuracy at least as high, 
+    a model size and fit time at least as low, and is better on at least one of these """
+    def dominates(pa, pb):
+        better = (pa["accuracy"] >= pb["accuracy"], pa["model_bytes"] <= pb["model_bytes"], pa["fit_sec"] <= pb["fit_sec"])
+        return all(better) and (pa["accuracy"], -pa["model_bytes"], -pa["fit_sec"]) != (pb["accuracy"], -pb["model_bytes"], -pb["fit_sec"])
+    return [ka for ka, pt in enumerate(points) if not any(dominates(other, pt) for other in points)]
+
+
+def run_grid_search(suffix):
+    """ fits the SEARCH_C x SEARCH_CLASS_WEIGHT x SEARCH_LOSS (x SEARCH_MIN_DF) grid to the cached folds of the
+    N_EXPERIMENTS stratified splits in N_JOBS processes, then reports the mean test scores of each setting, sorted by 
+    accuracy, and the Pareto front of accuracy against model size and fit time. Also saved as JSON """
+    os.makedirs(SEARCH_DIR, exist_ok=True)
+    t0 = time()
+    tasks, ncomputed = [], 0
+    for min_df in ([None] if N_HASH_FEATURES else SEARCH_MIN_DF):
+        for kex in range(N_EXPERIMENTS):
+            foldname, computed = cache_fold(kex, min_df)
+            ncomputed += computed
+            tasks.extend((foldname, kex, min_df, class_weight, loss) for class_weight in SEARCH_CLASS_WEIGHT for loss in SEARCH_LOSS)
+    nfold = len(tasks) // (len(SEARCH_CLASS_WEIGHT) * len(SEARCH_LOSS))
+    show("Folds: {:d} computed, {:d} from the cache in {:s}: {:.2f} sec".format(ncomputed, nfold - ncomputed, SEARCH_DIR, time() - t0))
+
+    njobs = N_JOBS or os.cpu_count() or 1
+    print("Fitting {:d} models in {:d} processes".format(len(tasks) * len(SEARCH_C), njobs))
     t0 = time()
-    for ka, xv in enumerate(X_test):
-        kt += 1
-        pred = lin_clf.predict([xv])
-        classmat[Ytest[ka]][pred[0]] +=1
-        if Ytest[ka] == pred[0]:
-            kcorr +=1
-    print("Time to fit {:d} cases {:0.3f} sec".format(kt, time() - t0))
-    fout.write("\nTime to fit {:d} cases {:0.3f} sec\n".format(kt, time() - t0))
-
-    print('Test set')
-    fout.write('Test set\n')
-    for ka, kv in enumerate(classmat):
-        tot = 0
-        print("{:>22s} | ".format(LABELS[ka]),end='')
-        fout.write("{:>22s} | ".format(LABELS[ka]))
-        nnc = 0
-        for kb, num in enumerate(kv):
-            print("{:4d}  ".format(num),end='')
-            fout.write("{:4d}  ".format(num))
-            tot += num
-            if ka == kb:
-                main = num
-            if kb != 0:
-                nnc += num
-                
-        if tot > 0:
-            print(' {:4d} ({:6.2f}%)  {:6.2f}%'.format(tot,float(tot*100)/kt, float(main*100)/tot), end="")
-            fout.write(' {:4d} ({:6.2f}%)  {:6.2f}%'.format(tot,float(tot*100)/kt, float(main*100)/tot))
-            if ka == 0:
-                print('  {:6.2f}%'.format(float(main*100)/tot))
-                fout.write('  {:6.2f}%\n'.format(float(main*100)/tot))
-            else:
-                print('  {:6.2f}%'.format(float(nnc*100)/tot))
-                fout.write('  {:6.2f}%\n'.format(float(nnc*100)/tot))
-            
-        else:
-            print(' ---')
-            fout.write(' ---\n')
-            
-fout.close()
-
-print('Saving model using all cases')
-
-Y = []
-corpus = []
-for filename in FILE_NAMES:
-    reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
-    print("Reading", FILE_PATH + filename)
-    for krec, rec in enumerate(reader):
-        Y.append(int(rec['mode'][0]))
-        corpus.append(rec['textInfo']['wordlist'])
-
-vectorizer = TfidfVectorizer(min_df=1)
-tfidf2 = vectorizer.fit_transform(corpus)
-pickle.dump(vectorizer, open(VECTORZ_PFILE_NAME, "wb"))
-X = tfidf2.toarray()
-
-lin_clf = svm.LinearSVC()
-lin_clf.fit(X, Y) 
-pickle.dump(lin_clf, open(MODEL_PFILE_NAME, "wb"))
-
-print("Finished")
+    if njobs > 1:
+        with ProcessPoolExecutor(njobs) as pool:
+            results = [res for task in pool.map(run_search, tasks) for res in task]
+    else:
+        results = [res for task in tasks for res in run_search(task)]
+    show("Grid search: {:.2f} sec".format(time() - t0))
+
+    settings = {}
+    for res in results:
+        settings.setdefault((str(res["min_df"]), str(res["class_weight"]), res["loss"], res["C"]), []).append(res)
+    points = []
+    for (min_df, class_weight, loss, C), folds in settings.items():
+        points.append({"min_df": folds[0]["min_df"], "class_weight": class_weight, "loss": loss, "C": C, "folds": len(folds),
+                       "accuracy": float(np.mean([res["accuracy"] for res in folds])),
+                       "accuracy_stddev": float(np.std([res["accuracy"] for res in folds], ddof=1)) if len(folds) > 1 else 0.0,
+                       "macro_f1": float(np.mean([res["macro_f1"] for res in folds])),
+                       "recall": np.mean([res["recall"] for res in folds], axis=0).tolist(),
+                       "features": int(np.mean([res["features"] for res in folds])),
+                       "model_bytes": int(np.mean([res["model_bytes"] for res in folds])),
+                       "fit_sec": float(np.mean([res["fit_sec"] for res in folds])),
+                       "converged": all(res["converged"] for res in folds)})
+    points.sort(key=lambda pt: -pt["accuracy"])
+    pareto = get_pareto(points)
+    for ka, pt in enumerate(points):
+        pt["pareto"] = ka in pareto
+
+    header = "{:>6s} {:>12s} {:>13s} {:>6s} | {:>7s} {:>6s} {:>7s} | {:>7s} {:>7s} {:>7s} | {:>7s} {:>10s} {:>7s}".format(
+            "min_df", "class_weight", "loss", "C", "acc", "sd", "macroF1", "opinion", "crime", "accid", "features", "bytes", "fit sec")
+    def format_point(pt):
+        return "{:>6s} {:>12s} {:>13s} {:6g} | {:6.2f}% {:5.2f}% {:6.2f}% | {:6.2f}% {:6.2f}% {:6.2f}% | {:7d} {:10,d} {:7.3f}{:s}{:s}".format(
+            "-" if pt["min_df"] is None else str(pt["min_df"]), pt["class_weight"], pt["loss"], pt["C"], pt["accuracy"]*100, pt["accuracy_stddev"]*100, 
+            pt["macro_f1"]*100, pt["recall"][4]*100, pt["recall"][5]*100, pt["recall"][6]*100, pt["features"], 
+            pt["model_bytes"], pt["fit_sec"], "  *" if pt["pareto"] else "", "" if pt["converged"] else "  (not converged)")
+    show("\n       ============ Mean test scores over {:d} folds: * = Pareto front ============".format(N_EXPERIMENTS))
+    show(header)
+    for pt in points:
+        show(format_point(pt))
+    show("\n       ============ Pareto front: accuracy vs. model size and fit time ============")
+    show(header)
+    for pt in sorted([points[ka] for ka in pareto], key=lambda pt: pt["model_bytes"]):
+        show(format_point(pt))
+
+    with open(SEARCH_RESULT_FILE_NAME + suffix + ".json", 'w') as fjson:
+        json.dump({"run": " ".join(utilFJML.get_date_time()), "file_path": FILE_PATH, "files": FILE_NAMES, 
+                   "train_prop": TRAIN_PROP, "seed": SEED, "hash_features": N_HASH_FEATURES, "max_features": MAX_FEATURES,
+                   "points": points, "folds": results}, fjson, indent=2, sort_keys=True)
+
+
+def get_calibration(results):
+    """ returns the calibration fitted to the test margins of the experiments, or None if the experiments do not have
+    the same classes, and shows the accuracy of the test cases grouped by their calibrated probability """
+    if any(not np.array_equal(res["classes"], results[0]["classes"]) for res in results):
+        show("Calibration: the experiments do not have the same classes")
+        return None
+    margins = np.vstack([res["test_margins"] for res in results])
+    modes = np.concatenate([res["test_modes"] for res in results])
+    calibration = modelFJML.fit_calibration(margins, modes, results[0]["classes"])
+    preds, margin, gap, probs = modelFJML.get_confidence(margins, results[0]["classes"], calibration)
+    show("\nCalibrated probability of the prediction for the {:d} test cases".format(len(modes)))
+    show("  probability   cases    mean  accuracy")
+    for low, high in [(0.0, 0.5), (0.5, 0.7), (0.7, 0.8), (0.8, 0.9), (0.9, 0.95), (0.95, 1.01)]:
+        inbin = (probs >= low) & (probs < high)
+        if inbin.any():
+            show("  {:4.2f} - {:4.2f}  {:6d}  {:6.2f}%  {:6.2f}%".format(low, min(high, 1.0), inbin.sum(), 
+                        probs[inbin].mean()*100, (preds[inbin] == modes[inbin]).mean()*100))
+    return calibration
+
+
+def get_model_size(vectorizer, model):
+    """ returns the size in bytes of the pickled vectorizer -- or its components -- and model and the time to unpickle 
+    them """
+    pstr = pickle.dumps((vectorizer, model))
+    t0 = time()
+    pickle.loads(pstr)
+    return len(pstr), time() - t0
+
+
+def get_memory(stage, X=None):
+    """ returns the size of the sparse matrix X, the size of the equivalent dense matrix and the peak memory use of the
+    process """
+    memstr = "Memory: {:s}:".format(stage)
+    if X is not None:
+        memstr += "  matrix {:,d} bytes (dense {:,d} bytes)".format(X.data.nbytes + X.indices.nbytes + X.indptr.nbytes,
+                                                               X.shape[0] * X.shape[1] * X.dtype.itemsize)
+    if resource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memstr += "  peak {:.1f} MB".format(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10))  # bytes on macOS, else KB
+    return memstr
+
+
+def report_memory(stage, X=None):
+    """ prints and writes the memory report """
+    show(get_memory(stage, X))
+
+
+def show(text):
+    """ prints text and writes it to fout if this is open """
+    print(text)
+    if not fout.closed:
+        fout.write(text + "\n")
+
+
+def check_dense(X, Y):
+    """ fits LinearSVC to the sparse matrix X and to X.toarray(); reports and returns the largest differences in the 
+    coefficients and intercepts and the number of cases of X whose predictions differ """
+    if N_CHECK_CASES:
+        X, Y = X[:N_CHECK_CASES], Y[:N_CHECK_CASES]
+    sparse_clf = svm.LinearSVC(random_state=0).fit(X, Y)
+    dense_clf = svm.LinearSVC(random_state=0).fit(X.toarray(), Y)
+    coefdiff = np.abs(sparse_clf.coef_ - dense_clf.coef_).max()
+    interdiff = np.abs(sparse_clf.intercept_ - dense_clf.intercept_).max()
+    npred = int((sparse_clf.predict(X) != dense_clf.predict(X.toarray())).sum())
+    print("Sparse/dense check on {:d} cases: maximum difference in coef_ {:.3g}, intercept_ {:.3g}; {:d} predictions differ".format(
+        X.shape[0], coefdiff, interdiff, npred))
+    return coefdiff, interdiff, npred
+
+
+for cmdopt in sys.argv:
+    if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+        theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+        if cmdopt == "-hv":
+            N_HASH_FEATURES = int(theopt)
+        elif cmdopt == "-mdf":
+            MIN_DF = int(theopt)
+        elif cmdopt == "-mf":
+            MAX_FEATURES = int(theopt)
+        elif cmdopt == "-cd":
+            N_CHECK_CASES = int(theopt)
+        elif cmdopt == "-vp":
+            VECTORZ_PFILE_NAME = theopt
+        elif cmdopt == "-mp":
+            MODEL_PFILE_NAME = theopt
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = theopt
+        elif cmdopt == "-cp":
+            CALIB_PFILE_NAME = theopt
+        elif cmdopt == "-s":
+            SEED = int(theopt)
+        elif cmdopt == "-j":
+            N_JOBS = int(theopt)
+        elif cmdopt == "-gs":
+            SEARCH_DIR = theopt
+        elif cmdopt == "-gc":
+            SEARCH_C = [float(C) for C in theopt.split(",")]
+    elif cmdopt.startswith('-'):
+        print("Unrecognized option: " + cmdopt, end=" ")
+        try:
+            print(sys.argv[sys.argv.index(cmdopt) + 1])
+        except:
+            print()
+
+if __name__ == "__main__":  # guard needed for the experiment worker processes
+    # Evaluate the model 
+    suffix = utilFJML.get_timed_suffix()
+    if SEARCH_DIR:
+        fout = open(SEARCH_RESULT_FILE_NAME + suffix + ".txt", 'w')
+        fout.write("SVM_FILTER_ESTIMATE.PY GRID SEARCH RESULTS\n")
+    else:
+        fout = open(TEST_RESULT_FILE_NAME + suffix + ".txt", 'w')
+        fout.write("SVM_FILTER_ESTIMATE.PY TRAIN/TEST RESULTS\n")
+    fout.write("Run datetime: {:s}\n".format(datetime.datetime.now().strftime('%y-%m-%d %H:%M:%S')))
+    fout.write("Training cases proportion: {:0.3f}\nTraining files\n".format(TRAIN_PROP))
+    fout.write("FILE_PATH: " + FILE_PATH + "\n")
+    for stnm in FILE_NAMES:
+        fout.write("  " + stnm + '\n')
+    if N_HASH_FEATURES:
+        fout.write("Vectorizer: HashingVectorizer(n_features={:d}) + TfidfTransformer\n".format(N_HASH_FEATURES))
+    else:
+        fout.write("Vectorizer: TfidfVectorizer(min_df={:d}, max_features={:s})\n".format(MIN_DF, str(MAX_FEATURES)))
+    fout.write("Stratified splits: seed {:d}\n".format(SEED))
+
+    Yall, corpus = read_corpus()
+    counter = get_counter()
+    Xcounts = counter.fit_transform(corpus).tocsr()   # sparse: do not use .toarray() here
+    terms = None if N_HASH_FEATURES else counter.get_feature_names_out()
+    report_memory("term counts", Xcounts)
+
+    if SEARCH_DIR:
+        run_grid_search(suffix)
+        fout.close()
+        print("Finished")
+        sys.exit()
+
+    N_JOBS = N_JOBS or min(os.cpu_count() or 1, N_EXPERIMENTS)
+    print("Running {:d} experiments in {:d} processes".format(N_EXPERIMENTS, N_JOBS))
+    if N_JOBS > 1:
+        with ProcessPoolExecutor(N_JOBS, initializer=init_experiment, initargs=(Xcounts, Yall, terms)) as pool:
+            results = list(pool.map(run_experiment, range(N_EXPERIMENTS)))
+    else:
+        results = [run_experiment(kex) for kex in range(N_EXPERIMENTS)]
+
+    report = {"run": " ".join(utilFJML.get_date_time()), "file_path": FILE_PATH, "files": FILE_NAMES, 
+              "train_prop": TRAIN_PROP, "seed": SEED, "hash_features": N_HASH_FEATURES, "min_df": MIN_DF, 
+              "max_features": MAX_FEATURES, "experiments": []}
+    for kex, res in enumerate(results):
+        show("\n       ============ Experiment {:d} ============".format(kex + 1))
+        for memstr in res["memory"]:
+            show(memstr)
+        show("Time to estimate: {:0.3f} sec".format(res["fit_time"]))
+        for line in evalFJML.format_training(res["train_mat"]):
+            show(line)
+        show("\nTime to fit {:d} cases {:0.3f} sec".format(res["test_mat"].sum(), res["predict_time"]))
+        for line in evalFJML.format_test(res["test_mat"]):
+            show(line)
+        scores = evalFJML.get_scores(res["test_mat"])
+        for line in evalFJML.format_scores(scores):
+            show(line)
+        show("Accuracy: {:.2f}%  features: {:d}  model size: {:,d} bytes  load time: {:.1f} msec".format(
+            scores["accuracy"]*100, res["nfeatures"], res["nbytes"], res["tload"]*1000))
+        report["experiments"].append({"train": evalFJML.get_scores(res["train_mat"]), "test": scores, 
+            "fit_sec": res["fit_time"], "predict_sec": res["predict_time"], "features": res["nfeatures"], 
+            "model_bytes": res["nbytes"], "load_msec": res["tload"]*1000})
+    report["summary"] = evalFJML.get_summary([exper["test"] for exper in report["experiments"]])
+    show("\n       ============ Summary of {:d} experiments ============".format(len(results)))
+    for line in evalFJML.format_summary(report["summary"]):
+        show(line)
+    calibration = get_calibration(results)
+    fout.close()
+    with open(TEST_RESULT_FILE_NAME + suffix + ".json", 'w') as fjson:
+        json.dump(report, fjson, indent=2, sort_keys=True)
+
+    print('Saving model using all cases')
+
+    Y = Yall
+    vectorizer = get_vectorizer()
+    X = vectorizer.fit_transform(corpus)
+    pickle.dump(vectorizer, open(VECTORZ_PFILE_NAME, "wb"))
+    report_memory("final tf/idf", X)
+
+    lin_clf = svm.LinearSVC()
+    lin_clf.fit(X, Y) 
+    report_memory("final estimate")
+    if N_CHECK_CASES is not None:
+        check_dense(X, Y)
+    pickle.dump(lin_clf, open(MODEL_PFILE_NAME, "wb"))
+    if calibration is not None:
+        pickle.dump(calibration, open(CALIB_PFILE_NAME, "wb"))
+    modelFJML.export_model(vectorizer, lin_clf, MODEL_DIR_NAME, calibration, cases=len(Y))
+
+    print("Finished")
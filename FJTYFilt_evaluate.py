@@ -5,11 +5,11 @@ Reads pickled files for a vectorized and model that were generated by SVM_filter
 vectors from the file INPUT_FILE_NAME which was generated by make_wordlists_nolabel.py. If the prediction corresponds
 to MODE, writes the urls of the case to screen and a file OUTPUT_PREFIX + "." + str(MODE) + ".urls.txt". 
 
-The command option -wp writes the wordlists of these predicted cases to a file WORDLIST_PREFIX + "." + str(MODE) + ".wordlists.txt":
-this is used when these cases will be added to a training set.
+The command option -wp writes the wordlists of these predicted cases, with the predicted "mode", to a file 
+WORDLIST_PREFIX + "." + str(MODE) + ".wordlists.txt": this is used when these cases will be added to a training set.
 
-The command options -sp and -sf writes the stories of these predicted cases to a file STORY_PREFIX + "." + str(MODE) + ".stories.txt":
-this is used when manually reviewing the classifications.
+The command options -sp and -sf writes the stories of these predicted cases, with "predicted" and "confidence" fields,
+to a file STORY_PREFIX + "." + str(MODE) + ".stories.txt": this is used when manually reviewing the classifications.
 
 TO RUN PROGRAM:
 
@@ -17,14 +17,71 @@ python3 classify_unlabelled.py -m <mode> [optional command pairs]
 
 Command option occur in pairs -<option> <value>. -m mode is required
 
+    -m MODE             : write the cases predicted as MODE. "-m all" classifies the cases once and writes a urls file 
+                          OUTPUT_PREFIX + "." + str(mode) + ".urls.txt" for every mode along with OUTPUT_PREFIX + 
+                          ".all.urls.txt"; -sp and -wp then also write a file for every mode. Default: all of the 
+                          modes in OUTPUT_PREFIX + ".all.urls.txt"
+
     -wf INPUT_FILE_NAME : name of the wordlist file of unlabelled vectors to be classified. Default: hard-coded name in program
     -fp OUTPUT_PREFIX   : prefix for the file which lists of the urls that were predicted as being MODE. Default: "Mode"
     -sp STORY_PREFIX    : prefix for file of stories for the cases that were predicted as being MODE. Default: do not write file
     -sf STORY_FILE_NAME : name of .stories.txt file used to generate the unlabelled vectors. Require if -sp is used
     -wp WORDLIST_PREFIX : prefix for file of wordlists for the cases that were predicted as being MODE. Default: do not write file
-
-
-PROGRAMMING NOTES: None
+    -cs CHUNK_SIZE      : number of cases vectorized and classified in each call to the model. Default: 1024
+    -md MODEL_DIR_NAME  : use the model directory written by FJTYFilt_estimator.py (see modelFJML.py) rather than the
+                          pickled vectorizer and model. Default: use the pickles
+    -vp VECTORZ_PFILE_NAME : pickled vectorizer. Default: save-vectorizer-Mk2.p
+    -mp MODEL_PFILE_NAME   : pickled model. Default: save-lin_clf-Mk2.p
+    -cp CALIB_PFILE_NAME   : pickled calibration written by FJTYFilt_estimator.py, used with the pickles to get the
+                          calibrated probabilities; a model directory includes its calibration. Default: none
+    -th THRESHOLD       : review threshold: cases whose confidence is below THRESHOLD are not written to the urls file
+                          but to the review queue OUTPUT_PREFIX + "." + str(MODE)/all + ".review-stories.jsonl", which
+                          can be read by FJTYFilt-plovigy.py, one story for each case. Requires -sf
+
+BULK MODE: classifies many wordlist files -- for example months of archived daily files -- in a pool of processes and
+writes a single urls file. The -sf, -sp, -wp and -th options cannot be used in bulk mode
+
+    -wg "GLOB"          : wordlist files matching the pattern GLOB, in sorted order; quote the pattern
+    -wl FILE_LIST       : read a simple list of wordlist file names, one name per line
+    -j N_JOBS           : number of processes. Default: the number of cores, at most the number of shards
+    -ss SHARD_SIZE      : files larger than SHARD_SIZE MB are divided into shards of about this size which are
+                          classified separately. Default: 64
+
+
+PROGRAMMING NOTES:
+
+1. Cases are read, vectorized and classified in chunks of CHUNK_SIZE: the tf/idf matrix for a chunk stays sparse and
+   the urls for the chunk are written as soon as it has been classified, so memory use does not grow with the size of
+   INPUT_FILE_NAME.
+
+2. Models estimated with either a TfidfVectorizer or, using the -hv option of FJTYFilt_estimator.py, a HashingVectorizer
+   can be used, either as pickles or as a model directory.
+
+3. Each line of the urls file also has the SVM margin of the predicted mode, "margin", the difference between this and
+   the second-largest margin, "gap", and, when the model has a calibration, the calibrated probability of the predicted
+   mode, "prob". These are computed for the whole chunk with the predictions. The confidence compared to the -th 
+   THRESHOLD is "prob" if it is available, otherwise "gap". 
+
+4. The review queue contains the complete records from STORY_FILE_NAME of the cases below the threshold, in file 
+   order, with "predicted" and "confidence" fields, so they can be labelled with FJTYFilt-plovigy.py. The stories for
+   the review queue and -sp are found together once all of the cases have been classified, from the set of their keys
+   (id, occurrence) -- see utilFJML.get_case_key() -- so each of several cases with the same id, which are common in
+   the feeds, gets its own story: the k-th case with an id in INPUT_FILE_NAME is the k-th story with that id in
+   STORY_FILE_NAME. If STORY_FILE_NAME has a RecordIndex sidecar file (see utilFJML.py; FJTYFilt-plovigy.py creates 
+   one), only those records are read, otherwise this is a single pass over STORY_FILE_NAME which stops when all of 
+   the cases are found.
+
+5. In bulk mode each shard -- a complete file or a byte range of a large file beginning at the start of a record (see 
+   utilFJML.get_shards()) -- is classified by one process, which writes its urls lines to a temporary part file. The 
+   model is loaded before the pool starts: processes started with fork share it copy-on-write, and a model directory
+   is memory-mapped in any case. When all the shards are done the part files are concatenated in file and shard
+   order, so the urls file is the same as classifying the files one at a time regardless of N_JOBS and SHARD_SIZE.
+   If a shard raises an exception, the file and byte range of the shard are reported, the shards not yet started are 
+   cancelled and the part files are removed.
+
+6. With -m all the lines for each output file are collected for a chunk and written with a single write, and the 
+   number of cases written to each file is reported at the end. This replaces running the program once for each mode,
+   which loads the model, reads the wordlist file and vectorizes the cases each time.
 
 
 SYSTEM REQUIREMENTS
@@ -47,6 +104,15 @@ REVISION HISTORY:
 31-Jan-17: Initial version
 23-Feb-17: Integrated functions of get_urls, get_urls_wordlists; added full cmd-opts
 04-Mar-20: Modified from classify_unlabelled.py to use the PLOVER formats
+18-Oct-26: Sparse chunked classification; -cs option
+18-Oct-26: NumPy model directories; -md option
+18-Oct-26: -vp and -mp options
+18-Oct-26: margins and calibrated probabilities; review queue; -cp and -th options
+18-Oct-26: Bulk mode; -wg, -wl, -j and -ss options
+18-Oct-26: -wp and -sp rewritten as a join on the ids of the predicted cases
+18-Oct-26: -m all writes a file for each mode in a single pass; -m 0 selects mode 0 rather than all modes
+18-Oct-26: -sp and review queue joined on (id, occurrence): cases with duplicate ids each get their story
+18-Oct-26: Bulk mode removes the part files and reports the failing shard if a shard cannot be classified
 
 =========================================================================================================
 """
@@ -54,20 +120,34 @@ REVISION HISTORY:
 import sys
 sys.path.insert(1, "../FJ-2/")
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import utilFJML
-import pickle
+import modelFJML
+import shutil
+import glob
 import json
+import time
 import os
 
-CMD_OPTIONS = ["-m", "-wf", "-sf", "-fp", "-sp", "-wp"]
+CMD_OPTIONS = ["-m", "-wf", "-sf", "-fp", "-sp", "-wp", "-cs", "-md", "-vp", "-mp", "-cp", "-th", "-wg", "-wl", "-j", "-ss"]
 
 FILE_PATH = "./"
 INPUT_FILE_NAME = "demo-REUT-20-02-25-wordlists.jsonl"  
 MODE = None
+FANOUT = False   # -m all
 STORY_FILE_NAME = None
 STORY_PREFIX = None
 WORDLIST_PREFIX = None
 OUTPUT_PREFIX = "Mode"
+CHUNK_SIZE = 1024
+MODEL_DIR_NAME = None
+VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
+MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+CALIB_PFILE_NAME = None
+REVIEW_THRESHOLD = None
+BULK_FILE_NAMES = None
+N_JOBS = None   # default: the number of cores, at most the number of shards
+SHARD_SIZE = 64   # MB
 
 FJFILT_CATEGORIES = [("0", "codeable"), ("1", "sports"), ("2", "culture/entertainment"), ("3", "business/finance"), 
         ("4", "opinion"), ("5", "crime"), ("6", "accidents"), ("7", "natural disaster"), ("8", "[open]"), 
@@ -78,7 +158,8 @@ for cmdopt in sys.argv:
     if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
         theopt = sys.argv[sys.argv.index(cmdopt) + 1]
         if cmdopt == "-m":
-            MODE = int(theopt)
+            FANOUT = theopt == "all"
+            MODE = None if FANOUT else int(theopt)
         elif cmdopt == "-wf":
             INPUT_FILE_NAME = theopt
         elif cmdopt == "-sf":
@@ -89,6 +170,26 @@ for cmdopt in sys.argv:
             WORDLIST_PREFIX = theopt
         elif cmdopt == "-fp":
             OUTPUT_PREFIX = theopt
+        elif cmdopt == "-cs":
+            CHUNK_SIZE = int(theopt)
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = theopt
+        elif cmdopt == "-vp":
+            VECTORZ_PFILE_NAME = theopt
+        elif cmdopt == "-mp":
+            MODEL_PFILE_NAME = theopt
+        elif cmdopt == "-cp":
+            CALIB_PFILE_NAME = theopt
+        elif cmdopt == "-th":
+            REVIEW_THRESHOLD = float(theopt)
+        elif cmdopt == "-wg":
+            BULK_FILE_NAMES = sorted(glob.glob(theopt))
+        elif cmdopt == "-wl":
+            BULK_FILE_NAMES = [line[:-1] for line in open(theopt, "r") if line.strip()]
+        elif cmdopt == "-j":
+            N_JOBS = int(theopt)
+        elif cmdopt == "-ss":
+            SHARD_SIZE = float(theopt)
     elif cmdopt.startswith('-'):
         print("Unrecognized option: " + cmdopt, end=" ")
         try:
@@ -96,60 +197,280 @@ for cmdopt in sys.argv:
         except:
             print()
             
-if STORY_PREFIX and not STORY_FILE_NAME:
-    print("STORY_FILE_NAME (-sf) is required if the -sp option is used")
-    sys.exit()
-
-
-if WORDLIST_PREFIX:
-    fwdl = open(WORDLIST_PREFIX + "." + str(MODE) + ".wordlists.txt", 'w')
-else:
-    fwdl = None
-
-#pvector = pickle.load(open("save.vectorizer.p", "rb"))
-#pmodel = pickle.load(open("save.lin_clf.p", "rb"))
-pvector = pickle.load(open("save-vectorizer-Mk2.p", "rb"))
-pmodel = pickle.load(open("save-lin_clf-Mk2.p", "rb"))
-
-
-testcase = []
-caseurl = []
-filename = INPUT_FILE_NAME
-reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
-print("\nReading", FILE_PATH + filename)
-for krec, rec in enumerate(reader):
-    testcase.append(rec["textInfo"]["wordlist"])
-    caseurl.append((rec["id"], rec["citeInfo"]["title"]))
-print(len(testcase),"cases")
-
-XP_test = pvector.transform(testcase).toarray()
-
-urls = []
-if MODE:
-    fout = open(OUTPUT_PREFIX + "." + str(MODE) + ".urls.txt", 'w')
-else:
-    fout = open(OUTPUT_PREFIX + ".all.urls.txt", 'w')
-for kcase, xv in enumerate(XP_test):
-    pred = pmodel.predict([xv])
-    if not MODE or pred[0] == MODE:
-        urls.append(caseurl[kcase])
-        print(urls[-1])
-        fout.write(json.dumps({"mode": str(pred[0]) + "-" + FJFILT_CATEGORIES[pred[0]][1], 
-                        "id": caseurl[kcase][0], 
-                        "title": caseurl[kcase][1]})
-                         + '\n')
-        if fwdl:
-            fwdl.write(str(MODE) + line[1:])
-
-fout.close()
-if fwdl:
-    fwdl.close()
-
-if STORY_PREFIX:
-    print("Getting stories from",STORY_FILE_NAME)
-    fsty = open(STORY_PREFIX + "." + str(MODE) + ".stories.txt", 'w')
-    fin = open(STORY_FILE_NAME,'r')
-    read_fin()
-    fsty.close()
-        
-print("Finished")
+def load_scorer():
+    """ loads the model directory or the pickled vectorizer, model and calibration """
+    if MODEL_DIR_NAME:
+        return modelFJML.load_model(MODEL_DIR_NAME)
+    else:
+        return modelFJML.load_pickles(VECTORZ_PFILE_NAME, MODEL_PFILE_NAME, CALIB_PFILE_NAME)
+
+
+def classify_chunk(chunk):
+    """ classifies a chunk of wordlist records with a single call to the model and returns (position in the chunk, 
+    record, prediction, scores, confidence) for the cases predicted as MODE """
+    # the tf/idf matrix stays sparse
+    preds, margins, gaps, probs = scorer.predict_confidence([rec["textInfo"]["wordlist"] for rec in chunk])
+    results = []
+    for ka, (rec, pred) in enumerate(zip(chunk, preds)):
+        if MODE is None or pred == MODE:
+            scores = {"margin": round(float(margins[ka]), 4), "gap": round(float(gaps[ka]), 4)}
+            if probs is not None:
+                scores["prob"] = round(float(probs[ka]), 4)
+            results.append((ka, rec, int(pred), scores, gaps[ka] if probs is None else probs[ka]))
+    return results
+
+
+def get_output_names(prefix, suffix, with_all=True):
+    """ returns {key: file name} for a set of output files, where key is a mode or "all". With -m all there is a file
+    for each mode and, if with_all, one for all of the modes; otherwise there is one file, for MODE or for all of the
+    modes """
+    if FANOUT:
+        names = {mode: prefix + "." + str(mode) + suffix for mode in range(len(FJFILT_CATEGORIES))}
+        if with_all:
+            names["all"] = prefix + ".all" + suffix
+        return names
+    key = "all" if MODE is None else MODE
+    return {key: prefix + "." + str(key) + suffix}
+
+
+def get_keys(pred, names):
+    """ returns the keys of the output files in names which get a case predicted as pred """
+    return [key for key in (pred, "all") if key in names]
+
+
+def format_counts(counts, names):
+    """ returns the lines of the report of the number of cases written to each output file """
+    lines = []
+    for key, name in names.items():
+        label = "all modes" if key == "all" else FJFILT_CATEGORIES[key][0] + "-" + FJFILT_CATEGORIES[key][1]
+        lines.append("{:>24s} {:8d}  {:s}".format(label, counts[key], name))
+    return lines
+
+
+def get_url_line(rec, pred, scores):
+    """ returns the line of the urls file for a case """
+    return json.dumps(dict({"mode": str(pred) + "-" + FJFILT_CATEGORIES[pred][1], 
+                            "id": rec["id"], 
+                            "title": rec["citeInfo"]["title"]}, **scores)) + '\n'
+
+
+def get_story_line(rec, pred, confidence):
+    """ returns a story record with its "predicted" mode and "confidence" """
+    rec["predicted"] = str(pred) + "-" + FJFILT_CATEGORIES[pred][1]
+    rec["confidence"] = round(float(confidence), 4)
+    return json.dumps(rec, indent=2, sort_keys=True ) + "\n"
+
+
+def init_worker():
+    """ loads the model in a bulk worker process unless it was inherited from the parent process """
+    global scorer
+    if scorer is None:
+        scorer = load_scorer()
+
+
+def classify_shard(shard):
+    """ classifies the records of a shard (see utilFJML.get_shards()) and writes their urls lines to the shard's part 
+    files, one for each urls file; returns the counts and timing """
+    filename, start, stop, partname = shard
+    names = get_output_names(OUTPUT_PREFIX, ".urls.txt")
+    t0 = time.time()
+    ncase, nwrit = 0, 0
+    counts = {key: 0 for key in names}
+    fparts = {key: open(partname + "." + str(key), "w") for key in names}
+    for chunk in utilFJML.get_chunks(utilFJML.read_shard(filename, start, stop), CHUNK_SIZE):
+        ncase += len(chunk)
+        lines = {key: [] for key in names}
+        for ka, rec, pred, scores, confidence in classify_chunk(chunk):
+            line = get_url_line(rec, pred, scores)
+            for key in get_keys(pred, names):
+                lines[key].append(line)
+                counts[key] += 1
+            nwrit += 1
+        for key, fpart in fparts.items():
+            fpart.write("".join(lines[key]))
+    for fpart in fparts.values():
+        fpart.close()
+    return {"file": filename, "start": start, "stop": stop, "cases": ncase, "written": nwrit, "counts": counts, 
+            "time": time.time() - t0}
+
+
+def report_failure(shards, kshard, exc):
+    """ reports the file and shard whose classification raised exc and exits """
+    filename, start, stop, partname = shards[kshard]
+    print("Shard {:d}/{:d} of {:s} [{:d}:{:d}] could not be classified: {:s}: {:s}".format(kshard + 1, len(shards),
+          filename, start, stop, type(exc).__name__, str(exc)))
+    print("No urls files were written; the part files have been removed")
+    sys.exit(1)
+
+
+def run_bulk(names):
+    """ classifies the files in BULK_FILE_NAMES, divided into shards of at most SHARD_SIZE MB, in a pool of N_JOBS 
+    processes, then merges the urls lines of the shards into the urls files in names in file and shard order """
+    global N_JOBS
+    shards = []
+    for filename in BULK_FILE_NAMES:
+        for start, stop in utilFJML.get_shards(filename, int(SHARD_SIZE * 1e6)):
+            shards.append((filename, start, stop, OUTPUT_PREFIX + ".part{:05d}".format(len(shards))))
+    N_JOBS = N_JOBS or min(os.cpu_count() or 1, len(shards))
+    print("Classifying {:d} files in {:d} shards with {:d} processes".format(len(BULK_FILE_NAMES), len(shards), N_JOBS))
+    t0 = time.time()
+    results = [None] * len(shards)
+    def show_progress(kshard, res):
+        results[kshard] = res
+        ndone = sum(1 for res in results if res)
+        print("{:4d}/{:d}  {:s} [{:d}:{:d}]  {:d} cases, {:d} written in {:.2f} sec".format(ndone, len(shards), 
+              res["file"], res["start"], res["stop"], res["cases"], res["written"], res["time"]))
+    try:
+        if N_JOBS > 1:
+            with ProcessPoolExecutor(N_JOBS, initializer=init_worker) as pool:
+                futures = {pool.submit(classify_shard, shard): kshard for kshard, shard in enumerate(shards)}
+                for future in as_completed(futures):
+                    try:
+                        res = future.result()
+                    except Exception as exc:
+                        pool.shutdown(cancel_futures=True)   # the shards already running finish before the cleanup
+                        report_failure(shards, futures[future], exc)
+                    show_progress(futures[future], res)
+        else:
+            for kshard, shard in enumerate(shards):
+                try:
+                    res = classify_shard(shard)
+                except Exception as exc:
+                    report_failure(shards, kshard, exc)
+                show_progress(kshard, res)
+        for key, name in names.items():
+            with open(name, "w") as fout:
+                for shard in shards:
+                    with open(shard[3] + "." + str(key), "r") as fpart:
+                        shutil.copyfileobj(fpart, fout)
+    finally:
+        for shard in shards:   # the part files are removed whether or not all of the shards were classified
+            for key in names:
+                if os.path.exists(shard[3] + "." + str(key)):
+                    os.remove(shard[3] + "." + str(key))
+    dt = max(time.time() - t0, 1e-9)
+    ncase, nwrit = sum(res["cases"] for res in results), sum(res["written"] for res in results)
+    print("Classified {:d} cases in {:.2f} sec: {:.1f} cases/sec; {:d} written".format(ncase, dt, ncase / dt, nwrit))
+    for line in format_counts({key: sum(res["counts"][key] for res in results) for key in names}, names):
+        print(line)
+
+
+scorer = None
+
+if __name__ == "__main__":  # guard needed for the bulk worker processes
+    if STORY_PREFIX and not STORY_FILE_NAME:
+        print("STORY_FILE_NAME (-sf) is required if the -sp option is used")
+        sys.exit()
+    if REVIEW_THRESHOLD is not None and not STORY_FILE_NAME:
+        print("STORY_FILE_NAME (-sf) is required if the -th option is used")
+        sys.exit()
+    if BULK_FILE_NAMES is not None:
+        if not BULK_FILE_NAMES:
+            print("No wordlist files were found for -wg or -wl")
+            sys.exit()
+        for filename in BULK_FILE_NAMES:
+            if not os.path.exists(filename):
+                print("The file", filename, "could not be found")
+                sys.exit()
+    if BULK_FILE_NAMES and (STORY_FILE_NAME or STORY_PREFIX or WORDLIST_PREFIX or REVIEW_THRESHOLD is not None):
+        print("The -sf, -sp, -wp and -th options cannot be used with -wg or -wl")
+        sys.exit()
+
+    scorer = load_scorer()   # loaded before the bulk workers start so that they share it
+    if REVIEW_THRESHOLD is not None and scorer.calibration is None:
+        print("The model has no calibration: the -th threshold is compared to the gap between the two largest margins")
+
+    urlnames = get_output_names(OUTPUT_PREFIX, ".urls.txt")
+
+    if BULK_FILE_NAMES:
+        run_bulk(urlnames)
+        print("Finished")
+        sys.exit()
+
+    fouts = {key: open(name, 'w') for key, name in urlnames.items()}
+    if WORDLIST_PREFIX:
+        fwdls = {key: open(name, 'w') for key, name in get_output_names(WORDLIST_PREFIX, ".wordlists.txt", False).items()}
+    else:
+        fwdls = {}
+
+    ncase = 0
+    counts = {key: 0 for key in urlnames}
+    review = {}   # (id, occurrence): (pred, confidence) of the cases for the review queue
+    selected = {}   # (id, occurrence): (pred, confidence) of the cases whose stories are written with -sp
+    nseen = {}   # id: number of cases read with the id, for utilFJML.get_case_key()
+    filename = INPUT_FILE_NAME
+    reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
+    print("\nReading", FILE_PATH + filename)
+    for chunk in utilFJML.get_chunks(reader, CHUNK_SIZE):
+        lines = {key: [] for key in fouts}   # each file is written once per chunk
+        wlines = {key: [] for key in fwdls}
+        casekeys = [utilFJML.get_case_key(rec["id"], nseen) for rec in chunk]
+        for ka, rec, pred, scores, confidence in classify_chunk(chunk):
+            if REVIEW_THRESHOLD is not None and confidence < REVIEW_THRESHOLD:
+                review[casekeys[ka]] = (pred, confidence)
+                continue
+            if not FANOUT:
+                caseurl = (rec["id"], rec["citeInfo"]["title"])
+                print(caseurl)
+            line = get_url_line(rec, pred, scores)
+            for key in get_keys(pred, fouts):
+                lines[key].append(line)
+                counts[key] += 1
+            if STORY_PREFIX:
+                selected[casekeys[ka]] = (pred, confidence)
+            if fwdls:
+                rec["mode"] = str(pred) + "-" + FJFILT_CATEGORIES[pred][1]
+                wline = json.dumps(rec, indent=2, sort_keys=True ) + "\n"
+                for key in get_keys(pred, fwdls):
+                    wlines[key].append(wline)
+        for key, fout in fouts.items():
+            fout.write("".join(lines[key]))
+            fout.flush()
+        for key, fwdl in fwdls.items():
+            fwdl.write("".join(wlines[key]))
+        ncase += len(chunk)
+    print(ncase,"cases")
+    for line in format_counts(counts, urlnames):
+        print(line)
+
+    for fout in list(fouts.values()) + list(fwdls.values()):
+        fout.close()
+
+    if REVIEW_THRESHOLD is not None or STORY_PREFIX:
+        # a single join of the review queue and -sp cases with the stories file
+        if os.path.exists(STORY_FILE_NAME + utilFJML.INDEX_SUFFIX):
+            print("Getting stories from", STORY_FILE_NAME, "using its index")
+            index = utilFJML.RecordIndex(STORY_FILE_NAME)
+        else:
+            print("Getting stories from", STORY_FILE_NAME)
+            index = None
+        if REVIEW_THRESHOLD is not None:
+            reviewname = OUTPUT_PREFIX + "." + ("all" if MODE is None else str(MODE)) + ".review-stories.jsonl"
+            frev = open(reviewname, 'w')
+        if STORY_PREFIX:
+            storynames = get_output_names(STORY_PREFIX, ".stories.txt", False)
+            fstys = {key: open(name, 'w') for key, name in storynames.items()}
+            nstory = {key: 0 for key in storynames}
+        nreview = 0
+        for casekey, rec in utilFJML.filter_records(STORY_FILE_NAME, set(review) | set(selected), index):
+            if casekey in review:
+                frev.write(get_story_line(rec, *review[casekey]))
+                nreview += 1
+            if casekey in selected:
+                pred, confidence = selected[casekey]
+                line = get_story_line(rec, pred, confidence)
+                for key in get_keys(pred, fstys):
+                    fstys[key].write(line)
+                    nstory[key] += 1
+        if REVIEW_THRESHOLD is not None:
+            frev.close()
+            print("{:d} cases below the threshold {:.3f}: {:d} stories written to {:s}".format(len(review), 
+                    REVIEW_THRESHOLD, nreview, reviewname))
+        if STORY_PREFIX:
+            for fsty in fstys.values():
+                fsty.close()
+            print("{:d} cases: stories written".format(len(selected)))
+            for line in format_counts(nstory, storynames):
+                print(line)
+
+    print("Finished")
@@ -0,0 +1,229 @@
+"""
+FJTYFilt_filter.py
+
+Streaming version of FJTYFilt_make_wordlists.py followed by FJTYFilt_evaluate.py: reads -stories files in PLOVER
+data-exchange (PDE) format, filters the words with spaCy, then vectorizes and classifies the wordlists with the pickled
+vectorizer and model generated by FJTYFilt_estimator.py, or the equivalent model directory (see modelFJML.py). Each 
+story is written to the output file with a "mode" field of the form "3-business/finance"; no intermediate files are 
+written unless -w is used.
+
+TO RUN PROGRAM:
+
+python3 FJTYFilt_filter.py -f <filename> [optional command pairs]
+
+Command options occur in pairs -<option> <value>. Either -f or -fl is required
+
+    -f FILE_NAME        : -stories file to classify
+    -fl FILE_LIST       : read a simple list of -stories file names, one name per line
+    -o OUTPUT_FILE_NAME : output file; default replaces "-stories" with "-filtered" in the name of the first file
+    -w WORDLIST_FILE    : also write the wordlists in the format produced by FJTYFilt_make_wordlists.py. Default: do not write file
+    -m MODE             : only write the stories predicted as MODE. Default: write all stories
+    -p PROFILE          : spaCy profile, "lean" or "full"; see FJTYFilt_make_wordlists.py. Default: lean
+    -bs BATCH_SIZE      : number of stories spaCy processes in each batch. Default: 64
+    -np N_PROCESS       : number of spaCy worker processes. Default: 1
+    -cs CHUNK_SIZE      : number of wordlists vectorized and classified in each call to the model. Default: 1024
+    -md MODEL_DIR_NAME  : use a model directory (see modelFJML.py) rather than the pickled vectorizer and model
+
+PROGRAMMING NOTES:
+
+1. The stages -- reading, spaCy, classification and writing -- are connected by queues of at most QUEUE_SIZE records,
+   so reading, classification and writing each run in their own thread and memory use does not depend on the size of
+   the input. spaCy runs in the main thread so that -np can start worker processes.
+
+2. The vectorizer and model are loaded once, when the program starts.
+
+SYSTEM REQUIREMENTS
+This program has been successfully run under Ubuntu 20.04; it is standard Python 3.7 so it should also run in Windows.
+
+PROVENANCE:
+Programmer: Philip A. Schrodt
+            Parus Analytics
+            Charlottesville, VA, 22901 U.S.A.
+            http://eventdata.parusanalytics.com
+
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+Report bugs to: schrodt735@gmail.com
+
+REVISION HISTORY:
+18-Oct-26: Initial version
+18-Oct-26: -md option for NumPy model directories
+
+=========================================================================================================
+"""
+
+import sys
+sys.path.insert(1, "../FJ-2/")
+
+import utilFJML
+import modelFJML
+import threading
+import queue
+import json
+import time
+import os
+
+CMD_OPTIONS = ["-f", "-fl", "-o", "-w", "-m", "-p", "-bs", "-np", "-cs", "-md"]
+
+FILE_PATH = "./"
+FILE_NAMES = []
+OUTPUT_FILE_NAME = None
+WORDLIST_FILE_NAME = None
+MODE = None
+PROFILE = "lean"
+BATCH_SIZE = 64
+N_PROCESS = 1
+CHUNK_SIZE = 1024
+
+QUEUE_SIZE = 256   # maximum number of records waiting between two stages
+
+MODEL_DIR_NAME = None
+VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
+MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+
+FJFILT_CATEGORIES = [("0", "codeable"), ("1", "sports"), ("2", "culture/entertainment"), ("3", "business/finance"),
+        ("4", "opinion"), ("5", "crime"), ("6", "accidents"), ("7", "natural disaster"), ("8", "[open]"),
+        ("9", "no codeable content")]
+
+DONE = None   # end-of-stream marker placed on a queue when a stage finishes
+
+
+def drain(qin):
+    """ generates the items from qin until DONE """
+    while True:
+        item = qin.get()
+        if item is DONE:
+            return
+        yield item
+
+
+def start_stage(stage, qin, qout):
+    """ runs stage(qin, qout) in a daemon thread. qout always gets DONE at the end; if the stage fails, the exception is
+    saved in errors and qin is drained so the upstream stage does not block """
+    def run():
+        try:
+            stage(qin, qout)
+        except Exception as err:
+            errors.append((stage.__name__, err))
+            if qin:
+                for item in drain(qin):
+                    pass
+        finally:
+            if qout:
+                qout.put(DONE)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def read_stage(qin, qout):
+    """ puts the records from FILE_NAMES on qout """
+    for filename in FILE_NAMES:
+        reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
+        print("Reading", FILE_PATH + filename)
+        for rec in reader:
+            qout.put(rec)
+
+
+def classify_stage(qin, qout):
+    """ vectorizes and classifies (rec, wordlist) pairs from qin in chunks, putting (rec, wordlist, pred) on qout """
+    for chunk in utilFJML.get_chunks(drain(qin), CHUNK_SIZE):
+        preds = scorer.predict([wordlist for rec, wordlist in chunk])
+        for (rec, wordlist), pred in zip(chunk, preds):
+            qout.put((rec, wordlist, pred))
+
+
+def write_stage(qin, qout):
+    """ writes the mode-annotated stories and, if requested, the wordlists """
+    global ncase, nwrit
+    fwdl = open(WORDLIST_FILE_NAME, 'w') if WORDLIST_FILE_NAME else None
+    with open(OUTPUT_FILE_NAME, 'w') as fout:
+        for rec, wordlist, pred in drain(qin):
+            ncase += 1
+            if fwdl:
+                pldict = {"textInfo": {"wordlist": wordlist}, "citeInfo": {"title": rec["citeInfo"]["title"]}, "id": rec["id"]}
+                if "mode" in rec:
+                    pldict['mode'] = rec['mode']
+                fwdl.write(json.dumps(pldict, indent=2, sort_keys=True ) + "\n")
+            if MODE is None or pred == MODE:
+                rec["mode"] = str(pred) + "-" + FJFILT_CATEGORIES[pred][1]
+                fout.write(json.dumps(rec, indent=2, sort_keys=True ) + "\n")
+                nwrit += 1
+            if ncase % 256 == 0:
+                print(ncase, rec["id"])
+    if fwdl:
+        fwdl.close()
+
+
+for cmdopt in sys.argv:
+    if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+        theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+        if cmdopt == "-f":
+            FILE_NAMES = [theopt]
+        elif cmdopt == "-fl":
+            FILE_NAMES = [line[:-1] for line in open(theopt, "r") if line.strip()]
+        elif cmdopt == "-o":
+            OUTPUT_FILE_NAME = theopt
+        elif cmdopt == "-w":
+            WORDLIST_FILE_NAME = theopt
+        elif cmdopt == "-m":
+            MODE = int(theopt)
+        elif cmdopt == "-p":
+            PROFILE = theopt
+        elif cmdopt == "-bs":
+            BATCH_SIZE = int(theopt)
+        elif cmdopt == "-np":
+            N_PROCESS = int(theopt)
+        elif cmdopt == "-cs":
+            CHUNK_SIZE = int(theopt)
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = theopt
+    elif cmdopt.startswith('-'):
+        print("Unrecognized option: " + cmdopt, end=" ")
+        try:
+            print(sys.argv[sys.argv.index(cmdopt) + 1])
+        except:
+            print()
+
+if __name__ == "__main__":  # guard needed for the spaCy worker processes when N_PROCESS > 1
+    if not FILE_NAMES:
+        print("A file name (-f) or file list (-fl) is required")
+        exit()
+    if not OUTPUT_FILE_NAME:
+        if "-stories." in FILE_NAMES[0]:
+            OUTPUT_FILE_NAME = FILE_NAMES[0].replace("-stories.","-filtered.") # use for regular name
+        else:
+            OUTPUT_FILE_NAME = "null-filtered-" + FILE_NAMES[0] # alternative if name is not regular
+
+    if MODEL_DIR_NAME:
+        scorer = modelFJML.load_model(MODEL_DIR_NAME)
+    else:
+        scorer = modelFJML.load_pickles(VECTORZ_PFILE_NAME, MODEL_PFILE_NAME)
+    print("Loading", utilFJML.SPACY_MODEL, "with the", PROFILE, "profile")
+    nlp = utilFJML.load_nlp(PROFILE)
+
+    errors = []
+    ncase, nwrit = 0, 0
+    qstory, qword, qpred = queue.Queue(QUEUE_SIZE), queue.Queue(QUEUE_SIZE), queue.Queue(QUEUE_SIZE)
+    t0 = time.time()
+    threads = [start_stage(read_stage, None, qstory),
+               start_stage(classify_stage, qword, qpred),
+               start_stage(write_stage, qpred, None)]
+    try:
+        stories = ((utilFJML.get_story(rec), rec) for rec in drain(qstory))
+        for parsed_review, rec in nlp.pipe(stories, as_tuples=True, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+            qword.put((rec, " ".join(utilFJML.get_wordlist(parsed_review))))
+    finally:
+        qword.put(DONE)
+    for thread in threads:
+        thread.join()
+    dt = max(time.time() - t0, 1e-9)
+
+    for stage, err in errors:
+        print("Error in", stage + ":", err)
+    print(ncase, "stories classified in {:.2f} sec: {:.1f} stories/sec; {:d} written to {:s}".format(
+        dt, ncase/dt, nwrit, OUTPUT_FILE_NAME))
+    if errors:
+        sys.exit(1)
+
+    print("Finished")
@@ -15,11 +15,33 @@ where
 -c: read a list of file names from the FJTY.plovigy.filerecs.txt output of FJTY.plovigy.py, so the file name is the fourth item in
     a space-limited string
 -o: output file name; otherwise set based on input files
+-bs: number of stories spaCy processes in each batch; default BATCH_SIZE
+-np: number of spaCy worker processes; default N_PROCESS
+-p: spaCy extraction profile: "lean" (default) does not load the dependency parser, "full" loads the complete pipeline
+-v: verification mode: parse the stories in the named file with both profiles, check that the wordlists are identical 
+    and report the time per story, then exit
+-k: wordlist cache file; default CACHE_FILE_NAME. "-k none" does not use a cache
 
 PROGRAMMING NOTES: 
 
 1. There is also a hard-coded default for FILE_NAMES
 
+2. Stories are processed with nlp.pipe(), which returns them in input order whatever the values of -bs and -np, so the 
+   output file is the same as when the stories are parsed one at a time. Each worker process loads its own copy of 
+   en_core_web_sm, so -np is only worthwhile for files with more than a few batches of stories.
+
+3. The word filter only uses the lemma, named-entity, stop-word, punctuation, space and number attributes of the tokens, 
+   none of which depend on the dependency parser, so the "lean" profile skips it. Use -v to confirm this on a given 
+   version of en_core_web_sm, e.g. -v demo-REUT-20-02-25-stories.jsonl
+
+4. Wordlists are cached in the SQLite file CACHE_FILE_NAME, keyed on the story id, a SHA-1 hash of the story text,
+   the spaCy model name and version and the components disabled by the -p profile, so stories which have already been
+   processed with the same profile -- for example in overlapping daily files -- are not parsed again. 
+
+5. Every CHECKPOINT_EVERY records the number of records written and the position in the output file are saved in 
+   outfilename + ".checkpoint". If a run is interrupted, re-running it with the same files and output name resumes from 
+   the last checkpoint rather than starting a new output file; the checkpoint is deleted when the run finishes.
+
 SYSTEM REQUIREMENTS
 This program has been successfully run under Mac OS 10.13.5; it is standard Python 3.7
 so it should also run in Unix or Windows. 
@@ -39,6 +61,10 @@ Report bugs to: schrodt735@gmail.com
 REVISION HISTORY:
 31-Jan-17:	Initial version
 04-Mar-20:  Modified from make_wordlists_nolabel.py to use PLOVER formats
+18-Oct-26:  Batched and multi-process parsing using nlp.pipe(); -bs and -np options
+18-Oct-26:  Lean spaCy profile without the parser; -p and -v options
+18-Oct-26:  Wordlist cache and resumable checkpoints; -k option
+18-Oct-26:  Cached wordlists keyed on the profile; fixed -np > 1 dropping the uncached stories
 
 =========================================================================================================
 """
@@ -46,42 +72,133 @@ import sys
 sys.path.insert(1, "../FJ-2/")  # this is specific, obviously, to the particular directory structure I was using
 
 import utilFJML
-import spacy
+import collections
+import hashlib
+import sqlite3
 import json
+import time
 import os
 
 FILE_PATH = "./"
 FILE_NAMES = ["REUT-20-02-25-stories.jsonl", "REUT-20-02-26-stories.jsonl", "REUT-20-02-27-stories.jsonl", "REUT-20-02-28-stories.jsonl"]
 FILE_NAMES = ["CovidEight-stories.jsonl"]  # useful if just processing a single file
 
-def get_words():
-    """ filter using spaCy and write remaining list """
-#    print(story)
-    story = ""
-    for lp in rec["textInfo"]["textStory"]:
-        story += " " + lp
-    parsed_review = nlp(story)
-#    print(str(parsed_review))
-    wlist = []
-    nnum = 0
-    for num, token in enumerate(parsed_review):
-        if token.like_num:
-            nnum += 1
-        if (len(token.lemma_) > 3) and \
-           (token.lemma_.isalpha()) and \
-           (token.ent_iob_ == 'O') and \
-           (not token.text[0].isupper()) and \
-            not (token.is_stop or token.is_punct or token.is_space or token.like_num):
-            wlist.append(token.lemma_)
-    pldict = {"textInfo": {"wordlist": " ".join(wlist)}, "citeInfo": {"title": rec["citeInfo"]["title"]}, "id": rec["id"]}
+BATCH_SIZE = 64
+N_PROCESS = 1
+PROFILE = "lean"
+
+CACHE_FILE_NAME = "FJTY.wordlists.cache.sqlite"
+CHECKPOINT_EVERY = 256  # records written between checkpoints
+
+def get_words(rec, wordlist):
+    """ write the filtered wordlist for rec """
+    pldict = {"textInfo": {"wordlist": wordlist}, "citeInfo": {"title": rec["citeInfo"]["title"]}, "id": rec["id"]}
     if "mode" in rec:
         pldict['mode'] = rec['mode']
     fout.write(json.dumps(pldict, indent=2, sort_keys=True ) + "\n")
+
+
+def read_stories():
+    """ generates the records from all of the files in FILE_NAMES """
+    for filename in FILE_NAMES[:]:
+        reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
+        print("\nReading", FILE_PATH + filename)
+        for rec in reader:
+            yield rec
+
+
+def open_cache(cachename):
+    """ opens or creates the wordlist cache """
+    cache = sqlite3.connect(cachename)
+    cache.execute("CREATE TABLE IF NOT EXISTS wordlists "
+                  "(id TEXT, hash TEXT, model TEXT, wordlist TEXT, PRIMARY KEY (id, hash, model))")
+    return cache
+
+
+def get_uncached(nskip):
+    """ generates (story, krec) tuples for nlp.pipe() for the stories which are not in the cache. Each record is added to 
+    pending as an entry [rec, wordlist, key] in input order; cached records already have their wordlist. The context is 
+    the record number rather than the entry because nlp.pipe() returns copies of the contexts when N_PROCESS > 1 """
+    global ncache
+    for krec, rec in enumerate(read_stories()):
+        if krec < nskip:
+            continue
+        story = utilFJML.get_story(rec)
+        key = (rec["id"], hashlib.sha1(story.encode("utf-8")).hexdigest(), modelname)
+        wordlist = None
+        if cache:
+            row = cache.execute("SELECT wordlist FROM wordlists WHERE id=? AND hash=? AND model=?", key).fetchone()
+            if row:
+                wordlist = row[0]
+                ncache += 1
+        entry = [rec, wordlist, key]
+        pending.append(entry)
+        if wordlist is None:
+            yield story, krec
+        else:
+            write_pending()
+
+
+def write_pending():
+    """ writes the entries at the head of pending which have their wordlists, so output stays in input order """
+    global ka
+    while pending and pending[0][1] is not None:
+        rec, wordlist, key = pending.popleft()
+        get_words(rec, wordlist)
+        ka += 1
+        if ka % 32 == 0:
+            print(ka, rec["id"])
+        if ka % CHECKPOINT_EVERY == 0:
+            write_checkpoint()
+
+
+def write_checkpoint():
+    """ commits the cache and saves the number of records and output position so an interrupted run can resume """
+    if cache:
+        cache.commit()
+    fout.flush()
+    with open(checkpointname, "w") as fchk:
+        fchk.write(json.dumps({"files": FILE_NAMES, "nrec": ka, "offset": fout.tell()}))
+
+
+def read_checkpoint():
+    """ returns the number of records and the output file offset saved by an interrupted run over the same files """
+    if not os.path.exists(checkpointname) or not os.path.exists(outfilename):
+        return 0, 0
+    with open(checkpointname, "r") as fchk:
+        chk = json.load(fchk)
+    if chk["files"] != FILE_NAMES:
+        print("Checkpoint", checkpointname, "is for a different file list: starting a new output file")
+        return 0, 0
+    return chk["nrec"], chk["offset"]
+            
+    
+def compare_profiles(filename):
+    """ parse the stories in filename with the full and lean profiles, report the mismatched wordlists and time per story """
+    recs = list(utilFJML.read_file(filename))
+    stories = [utilFJML.get_story(rec) for rec in recs]
+    wordlists, pertime = {}, {}
+    for profile in ["full", "lean"]:
+        nlp = utilFJML.load_nlp(profile)
+        print("Profile", profile + ":", ", ".join(nlp.pipe_names))
+        t0 = time.time()
+        wordlists[profile] = [utilFJML.get_wordlist(doc) for doc in nlp.pipe(stories, batch_size=BATCH_SIZE)]
+        pertime[profile] = (time.time() - t0) / max(len(stories), 1)
+    nmiss = 0
+    for rec, wfull, wlean in zip(recs, wordlists["full"], wordlists["lean"]):
+        if wfull != wlean:
+            print("Mismatch:", rec["id"])
+            nmiss += 1
+    print("{:d} stories, {:d} mismatched wordlists".format(len(stories), nmiss))
+    print("Time per story: full {:.2f} msec  lean {:.2f} msec  speedup {:.2f}x".format(
+        pertime["full"]*1000, pertime["lean"]*1000, pertime["full"]/max(pertime["lean"], 1e-9)))
             
     
 outfilename = None
+verifyfilename = None
+cachename = CACHE_FILE_NAME
 for cmdopt in sys.argv: # yes, I know there is also a massive package that can do this...
-    if cmdopt.startswith('-') and cmdopt in ["-o", "-f", "-c"]:
+    if cmdopt.startswith('-') and cmdopt in ["-o", "-f", "-c", "-bs", "-np", "-p", "-v", "-k"]:
         theopt = sys.argv[sys.argv.index(cmdopt) + 1]
         if cmdopt in ["-f", "-c"]:
             try:
@@ -96,6 +213,16 @@ for cmdopt in sys.argv: # yes, I know there is also a massive package that can d
                 exit()
         if cmdopt == "-o":
             outfilename = theopt
+        elif cmdopt == "-bs":
+            BATCH_SIZE = int(theopt)
+        elif cmdopt == "-np":
+            N_PROCESS = int(theopt)
+        elif cmdopt == "-p":
+            PROFILE = theopt
+        elif cmdopt == "-v":
+            verifyfilename = theopt
+        elif cmdopt == "-k":
+            cachename = None if theopt.lower() == "none" else theopt
     elif cmdopt.startswith('-'):
         print("Unrecognized option: " + cmdopt, end=" ")
         try:
@@ -111,22 +238,48 @@ if not outfilename:
         outfilename = "null-wordlists-" + FILE_NAMES[0] # alternative if name is not regular
 
 
-print("Loading en_core_web_sm")
-nlp = spacy.load('en_core_web_sm')
+if __name__ == "__main__" and verifyfilename:
+    compare_profiles(verifyfilename)
+    exit()
 
-ka = 0
-fout = open(outfilename,'w')
-for filename in FILE_NAMES[:]:
-    reader = utilFJML.read_file(os.path.join(FILE_PATH, filename))
-    print("\nReading", FILE_PATH + filename)
-    for krec, rec in enumerate(reader):
-        if krec % 32 == 0:
-            print(krec, rec["id"])
-        get_words()
-        ka += 1
-#        if krec > 3: break
+if __name__ == "__main__":  # guard needed for the worker processes when N_PROCESS > 1
+    print("Loading", utilFJML.SPACY_MODEL, "with the", PROFILE, "profile")
+    nlp = utilFJML.load_nlp(PROFILE)
+
+    modelname = "{:s}_{:s}-{:s} disable={:s}".format(nlp.meta["lang"], nlp.meta["name"], nlp.meta["version"],
+                                                     ",".join(sorted(utilFJML.SPACY_DISABLE[PROFILE])))
+    cache = open_cache(cachename) if cachename else None
+
+    checkpointname = outfilename + ".checkpoint"
+    nskip, offset = read_checkpoint()
+    if nskip:
+        print("Resuming after record", nskip, "of", outfilename)
+        fout = open(outfilename, 'r+')
+        fout.truncate(offset)  # discard anything written after the checkpoint
+        fout.seek(offset)
+    else:
+        fout = open(outfilename, 'w')
+
+    ka, ncache = nskip, 0
+    pending = collections.deque()
+    t0 = time.time()
+    for parsed_review, krec in nlp.pipe(get_uncached(nskip), as_tuples=True, batch_size=BATCH_SIZE, n_process=N_PROCESS):
+        entry = pending[krec - ka]   # pending starts at record ka, the next one to be written
+        entry[1] = " ".join(utilFJML.get_wordlist(parsed_review))
+        if cache:
+            cache.execute("INSERT OR REPLACE INTO wordlists VALUES (?, ?, ?, ?)", entry[2] + (entry[1],))
+        write_pending()
+    write_pending()
+    dt = max(time.time() - t0, 1e-9)
+
+    fout.close()
+    if cache:
+        cache.commit()
+        cache.close()
+    if os.path.exists(checkpointname):
+        os.remove(checkpointname)
 
-print(ka, "stories processed")
-fout.close()
+    print(ka - nskip, "stories processed in {:.2f} sec: {:.1f} stories/sec; {:d} from the cache".format(
+        dt, (ka - nskip)/dt, ncache))
 
-print("Finished")
\ No newline at end of file
+    print("Finished")
@@ -0,0 +1,325 @@
+"""
+FJTYFilt_service.py
+
+Classification service: loads the pickled vectorizer and model generated by FJTYFilt_estimator.py once, then classifies
+records sent to a local HTTP endpoint. Records are either wordlists in the format produced by FJTYFilt_make_wordlists.py
+or stories in PLOVER data-exchange (PDE) format; spaCy is loaded the first time a story is received.
+
+TO RUN PROGRAM:
+
+python3 FJTYFilt_service.py [optional command pairs]
+
+Command options occur in pairs -<option> <value>.
+
+    -po PORT            : port on localhost. Default: 8090
+    -mb MAX_BATCH       : maximum number of records classified in a single call to the model. Default: 256
+    -bw BATCH_WINDOW    : milliseconds to wait for more requests after the first one in a batch. Default: 5
+    -p PROFILE          : spaCy profile used for stories, "lean" or "full". Default: lean
+    -lt FILE_NAME       : load test: rather than starting the service, send the records in FILE_NAME one at a time to a
+                          service already running on PORT and report the latency and throughput
+    -nc N_CLIENTS       : number of concurrent clients in the load test. Default: 8
+    -md MODEL_DIR_NAME  : use a model directory (see modelFJML.py) rather than the pickled vectorizer and model
+
+ENDPOINTS
+
+POST /classify   body is a single record or a JSON list of records; returns a list of {"id": ..., "mode": ...}
+GET  /stats      returns the number of requests and cases, the p50 and p99 request latency in milliseconds, the mean
+                 batch size and the throughput in cases/second since the service started
+
+Example:
+    curl -d @record.json http://localhost:8090/classify
+
+PROGRAMMING NOTES:
+
+1. Requests are handled in separate threads but are classified in micro-batches by a single batching thread: the batch
+   is closed BATCH_WINDOW msec after its first request arrives or when it reaches MAX_BATCH records, whichever comes
+   first. Larger windows increase throughput under load at the cost of latency for isolated requests.
+
+2. The latencies of the last LATENCY_SAMPLES requests are used for the percentiles.
+
+3. Requests are checked before they are queued: a body which is not a record or a list of records, or a record without
+   a "textInfo" with either a "wordlist" string or a "textStory" list of strings, gets a 400 response. If a batch still
+   fails, its requests are classified one at a time so that only the request which failed gets the 500 response.
+
+SYSTEM REQUIREMENTS
+This program has been successfully run under Ubuntu 20.04; it is standard Python 3.7 so it should also run in Windows.
+
+PROVENANCE:
+Programmer: Philip A. Schrodt
+            Parus Analytics
+            Charlottesville, VA, 22901 U.S.A.
+            http://eventdata.parusanalytics.com
+
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+Report bugs to: schrodt735@gmail.com
+
+REVISION HISTORY:
+18-Oct-26: Initial version
+18-Oct-26: -md option for NumPy model directories
+18-Oct-26: 400 response for any malformed request; a failed batch only fails the request which caused it
+
+=========================================================================================================
+"""
+
+import sys
+sys.path.insert(1, "../FJ-2/")
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import urllib.request
+import collections
+import threading
+import utilFJML
+import modelFJML
+import queue
+import json
+import time
+
+CMD_OPTIONS = ["-po", "-mb", "-bw", "-p", "-lt", "-nc", "-md"]
+
+PORT = 8090
+MAX_BATCH = 256
+BATCH_WINDOW = 5
+PROFILE = "lean"
+LOADTEST_FILE_NAME = None
+N_CLIENTS = 8
+
+LATENCY_SAMPLES = 10000
+
+MODEL_DIR_NAME = None
+VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
+MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+
+FJFILT_CATEGORIES = [("0", "codeable"), ("1", "sports"), ("2", "culture/entertainment"), ("3", "business/finance"),
+        ("4", "opinion"), ("5", "crime"), ("6", "accidents"), ("7", "natural disaster"), ("8", "[open]"),
+        ("9", "no codeable content")]
+
+
+class Stats:
+    """ request latencies and case counts """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.nreq, self.ncase, self.nbatch = 0, 0, 0
+
+    def add_request(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.nreq += 1
+
+    def add_batch(self, ncase):
+        with self.lock:
+            self.nbatch += 1
+            self.ncase += ncase
+
+    def report(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+            dt = max(time.time() - self.start, 1e-9)
+            return {"requests": self.nreq, "cases": self.ncase,
+                    "p50_msec": get_percentile(lat, 50) * 1000, "p99_msec": get_percentile(lat, 99) * 1000,
+                    "mean_batch": self.ncase / max(self.nbatch, 1), "cases_per_sec": self.ncase / dt}
+
+
+def get_percentile(values, pct):
+    """ nearest-rank percentile of a sorted list """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def get_nlp():
+    """ loads spaCy the first time a story is classified """
+    global nlp
+    if not nlp:
+        print("Loading", utilFJML.SPACY_MODEL, "with the", PROFILE, "profile")
+        nlp = utilFJML.load_nlp(PROFILE)
+    return nlp
+
+
+def get_wordlists(recs):
+    """ returns the wordlists of recs, parsing the stories which do not already have one """
+    wordlists = [rec["textInfo"].get("wordlist") for rec in recs]
+    stories = [(utilFJML.get_story(rec), ka) for ka, rec in enumerate(recs) if wordlists[ka] is None]
+    if stories:
+        for doc, ka in get_nlp().pipe(stories, as_tuples=True):
+            wordlists[ka] = " ".join(utilFJML.get_wordlist(doc))
+    return wordlists
+
+
+def get_records(body):
+    """ returns the list of records in a request body; raises ValueError if it is not a record or a list of records 
+    which have either a wordlist or a story """
+    recs = json.loads(body)
+    if isinstance(recs, dict):
+        recs = [recs]
+    if not isinstance(recs, list):
+        raise ValueError("the body must be a record or a list of records")
+    for rec in recs:
+        if not isinstance(rec, dict) or not isinstance(rec.get("textInfo"), dict):
+            raise ValueError("records require a textInfo field")
+        textinfo = rec["textInfo"]
+        if textinfo.get("wordlist") is not None:
+            if not isinstance(textinfo["wordlist"], str):
+                raise ValueError("textInfo.wordlist must be a string")
+        elif not isinstance(textinfo.get("textStory"), list) or \
+             not all(isinstance(para, str) for para in textinfo["textStory"]):
+            raise ValueError("records require either textInfo.wordlist or a textInfo.textStory list of strings")
+    return recs
+
+
+def classify(recs):
+    """ returns the modes of recs """
+    return [str(pred) + "-" + FJFILT_CATEGORIES[pred][1] for pred in scorer.predict(get_wordlists(recs))]
+
+
+def run_batcher():
+    """ collects requests from qrequest into micro-batches and classifies each batch with a single call to the model """
+    while True:
+        batch = [qrequest.get()]
+        ncase = len(batch[0][0])
+        deadline = time.time() + BATCH_WINDOW / 1000
+        while ncase < MAX_BATCH:
+            try:
+                batch.append(qrequest.get(timeout=max(deadline - time.time(), 0)))
+                ncase += len(batch[-1][0])
+            except queue.Empty:
+                break
+        recs = [rec for req in batch for rec in req[0]]
+        try:
+            modes = classify(recs)
+        except Exception:
+            for req in batch:   # classify the requests separately so only the ones which fail get the error
+                try:
+                    req[1]["modes"] = classify(req[0])
+                    stats.add_batch(len(req[0]))
+                except Exception as err:
+                    req[1]["error"] = str(err)
+                req[2].set()
+            continue
+        stats.add_batch(len(recs))
+        ka = 0
+        for req in batch:
+            req[1]["modes"] = modes[ka:ka + len(req[0])]
+            ka += len(req[0])
+            req[2].set()
+
+
+class ClassifyServer(ThreadingHTTPServer):
+    request_queue_size = 128   # listen() backlog: the default of 5 drops connections under load
+
+
+class ClassifyHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, code, result):
+        body = json.dumps(result).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, stats.report())
+        else:
+            self.send_json(404, {"error": "unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self.send_json(404, {"error": "unknown path " + self.path})
+            return
+        t0 = time.time()
+        try:
+            recs = get_records(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as err:   # includes json.JSONDecodeError and UnicodeDecodeError
+            self.send_json(400, {"error": str(err)})
+            return
+        result, done = {}, threading.Event()
+        if recs:
+            qrequest.put((recs, result, done))
+            done.wait()
+        if "error" in result:
+            self.send_json(500, result)
+            return
+        self.send_json(200, [{"id": rec.get("id"), "mode": mode} for rec, mode in zip(recs, result.get("modes", []))])
+        stats.add_request(time.time() - t0)
+
+    def log_message(self, format, *args):
+        pass   # the default logs every request to stderr
+
+
+def run_loadtest():
+    """ sends the records in LOADTEST_FILE_NAME one at a time from N_CLIENTS threads and reports latency and throughput """
+    recs = list(utilFJML.read_file(LOADTEST_FILE_NAME))
+    url = "http://localhost:{:d}/classify".format(PORT)
+    latencies = []
+    def client(krec):
+        for rec in recs[krec::N_CLIENTS]:
+            t0 = time.time()
+            req = urllib.request.Request(url, data=json.dumps(rec).encode("utf-8"))
+            urllib.request.urlopen(req).read()
+            latencies.append(time.time() - t0)
+    t0 = time.time()
+    clients = [threading.Thread(target=client, args=(ka,)) for ka in range(N_CLIENTS)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    dt = max(time.time() - t0, 1e-9)
+    latencies.sort()
+    print("{:d} requests from {:d} clients in {:.2f} sec: {:.1f} requests/sec".format(len(latencies), N_CLIENTS, dt, len(latencies)/dt))
+    print("Latency p50 {:.2f} msec  p99 {:.2f} msec".format(get_percentile(latencies, 50) * 1000, get_percentile(latencies, 99) * 1000))
+    print("Service:", urllib.request.urlopen("http://localhost:{:d}/stats".format(PORT)).read().decode("utf-8"))
+
+
+for cmdopt in sys.argv:
+    if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+        theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+        if cmdopt == "-po":
+            PORT = int(theopt)
+        elif cmdopt == "-mb":
+            MAX_BATCH = int(theopt)
+        elif cmdopt == "-bw":
+            BATCH_WINDOW = float(theopt)
+        elif cmdopt == "-p":
+            PROFILE = theopt
+        elif cmdopt == "-lt":
+            LOADTEST_FILE_NAME = theopt
+        elif cmdopt == "-nc":
+            N_CLIENTS = int(theopt)
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = theopt
+    elif cmdopt.startswith('-'):
+        print("Unrecognized option: " + cmdopt, end=" ")
+        try:
+            print(sys.argv[sys.argv.index(cmdopt) + 1])
+        except:
+            print()
+
+if LOADTEST_FILE_NAME:
+    run_loadtest()
+    exit()
+
+if MODEL_DIR_NAME:
+    scorer = modelFJML.load_model(MODEL_DIR_NAME)
+else:
+    scorer = modelFJML.load_pickles(VECTORZ_PFILE_NAME, MODEL_PFILE_NAME)
+nlp = None
+
+stats = Stats()
+qrequest = queue.Queue()
+threading.Thread(target=run_batcher, daemon=True).start()
+
+server = ClassifyServer(("localhost", PORT), ClassifyHandler)
+print("Classifying on http://localhost:{:d}/classify".format(PORT))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+print(json.dumps(stats.report()))
+
+print("Finished")
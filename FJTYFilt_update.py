@@ -0,0 +1,371 @@
+"""
+FJTYFilt_update.py
+
+Incremental training: folds new labelled cases into an existing model in a few seconds rather than re-estimating the
+model on the entire training set with FJTYFilt_estimator.py. The model is a linear SVM -- SGDClassifier with hinge
+loss -- over a fixed feature space, so new cases never change the features, and each update is a few passes of 
+partial_fit over the new cases only. A new history starts from the model directory written by FJTYFilt_estimator.py,
+keeping its vocabulary and idf weights and continuing from its coefficients; without one it starts from zero 
+coefficients over a HashingVectorizer feature space, where new words also never change the features.
+
+Every update writes a new version of the model to the model history directory HISTORY_DIR and makes it the current
+version; earlier versions are kept so the model can be rolled back. Each version is a model directory (see
+modelFJML.py) so it can be used with the -md option of FJTYFilt_evaluate.py, FJTYFilt_filter.py and
+FJTYFilt_service.py: -md HISTORY_DIR uses the current version, -md HISTORY_DIR/v0003 a specific one.
+
+TO RUN PROGRAM:
+
+python3 FJTYFilt_update.py -f <filename> [optional command pairs]
+
+Command options occur in pairs -<option> <value>. With neither -f, -fl nor -rb, the history is listed.
+
+    -f FILE_NAME        : labelled file to fold into the current model: either wordlists in the format produced by
+                          FJTYFilt_make_wordlists.py or -labelled- stories from FJTYFilt-plovigy.py, which are
+                          filtered with spaCy. Records without a "mode" field are skipped
+    -fl FILE_LIST       : read a simple list of labelled file names, one name per line
+    -hd HISTORY_DIR     : model history directory. Default: FJTY_Model-history
+    -rb VERSION         : roll back: make VERSION, for example v0002, the current version. Later updates start from
+                          this version
+    -ep N_EPOCHS        : number of passes of partial_fit over the new cases. Default: 5
+    -tf TEST_FILE_NAME  : labelled wordlist file used to report the accuracy of the model before and after the update;
+                          the accuracy is saved in the history
+    -md MODEL_DIR_NAME  : model directory the history starts from when it is created; "-md none" starts from an empty
+                          model over N_FEATURES hashed features. Default: FJTY_Model-Mk2 if it exists, otherwise none
+    -hv N_FEATURES      : number of hashed features when the history is created without a model. Default: 262144
+    -p PROFILE          : spaCy profile used for stories, "lean" or "full". Default: lean
+
+PROGRAMMING NOTES:
+
+1. HISTORY_DIR contains the versions v0001, v0002, ..., the file "current" with the name of the current version, and
+   history.jsonl with one line per version: its parent, date, files and number of cases. "current" is replaced
+   atomically, so a program loading the model never sees a partial name, and a version is complete before it becomes
+   current. Besides the model directory arrays, each version has the pickled state of the SGDClassifier without its 
+   coefficients, sgd-state.p: the next update continues from this and the coefficients in coef.npy, so each version 
+   only stores the coefficients once. The features of the cases are computed by the modelFJML.Scorer of the version.
+
+2. A file whose contents (SHA1) have already been folded into the current version or one of its parents is skipped,
+   so re-running an update with the same file list only adds the new files.
+
+3. The idf weights of the starting model are kept: re-estimating them as cases are added would change the features
+   the existing coefficients were estimated on. Without a starting model the tf weights are l2-normalized without idf 
+   weights.
+
+4. The order of the new cases is shuffled in each pass, with a seed from the version number, so an update can be
+   reproduced. Since the updates only see the new cases, a long run of updates from a single category will pull the
+   model towards that category: compare the -tf accuracy of the versions and roll back if needed, and re-estimate
+   with FJTYFilt_estimator.py from time to time.
+
+5. The first version continues from the LinearSVC coefficients of the starting model with the step size partial_fit
+   would have reached after the number of cases the model was estimated on, "cases" in its meta.json, so a few dozen
+   new cases adjust the model rather than replacing it. The objective is the SGD hinge loss rather than the LinearSVC
+   squared hinge, so later versions gradually move away from the LinearSVC solution.
+
+SYSTEM REQUIREMENTS
+This program has been successfully run under Ubuntu 20.04; it is standard Python 3.7 so it should also run in Windows.
+
+PROVENANCE:
+Programmer: Philip A. Schrodt
+            Parus Analytics
+            Charlottesville, VA, 22901 U.S.A.
+            http://eventdata.parusanalytics.com
+
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+Report bugs to: schrodt735@gmail.com
+
+REVISION HISTORY:
+18-Oct-26: Initial version
+18-Oct-26: a new history starts from the estimated model; each version stores the coefficients once
+
+=========================================================================================================
+"""
+
+import sys
+sys.path.insert(1, "../FJ-2/")
+
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import make_pipeline
+import scipy.sparse
+import numpy as np
+import utilFJML
+import modelFJML
+import evalFJML
+import hashlib
+import pickle
+import json
+import types
+import time
+import os
+
+CMD_OPTIONS = ["-f", "-fl", "-hd", "-rb", "-ep", "-tf", "-md", "-hv", "-p"]
+
+FILE_NAMES = []
+HISTORY_DIR = "FJTY_Model-history"
+ROLLBACK_VERSION = None
+N_EPOCHS = 5
+TEST_FILE_NAME = None
+MODEL_DIR_NAME = "FJTY_Model-Mk2"   # written by FJTYFilt_estimator.py
+N_HASH_FEATURES = 1 << 18
+PROFILE = "lean"
+
+ALPHA = 1e-4   # SGDClassifier regularization
+SEED = 0
+N_MODE = 10  # maximum number of unique modes
+
+CURRENT_FILE_NAME = "current"
+HISTORY_FILE_NAME = "history.jsonl"
+STATE_PFILE_NAME = "sgd-state.p"
+
+
+def read_history():
+    """ returns the history entries, oldest first """
+    filename = os.path.join(HISTORY_DIR, HISTORY_FILE_NAME)
+    if not os.path.exists(filename):
+        return []
+    with open(filename, "r") as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def get_current():
+    """ returns the name of the current version, or None if there is no model yet """
+    filename = os.path.join(HISTORY_DIR, CURRENT_FILE_NAME)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, "r") as fin:
+        return fin.read().strip()
+
+
+def set_current(version):
+    """ makes version the current version """
+    tmpname = os.path.join(HISTORY_DIR, CURRENT_FILE_NAME + ".tmp")
+    with open(tmpname, "w") as fout:
+        fout.write(version + "\n")
+    os.replace(tmpname, os.path.join(HISTORY_DIR, CURRENT_FILE_NAME))
+
+
+def get_lineage(history, version):
+    """ returns the history entries of version and its parents, oldest first """
+    entries = {entry["version"]: entry for entry in history}
+    lineage = []
+    while version:
+        lineage.append(entries[version])
+        version = entries[version]["parent"]
+    return lineage[::-1]
+
+
+def get_file_hash(filename):
+    """ returns the SHA1 of the contents of filename """
+    sha = hashlib.sha1()
+    with open(filename, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def read_cases(filename):
+    """ returns the modes and wordlists of the labelled records in filename; stories without a wordlist are filtered
+    with spaCy """
+    global nlp
+    Y, wordlists, stories = [], [], []
+    for rec in utilFJML.read_file(filename):
+        if "mode" not in rec:
+            continue
+        Y.append(int(rec["mode"][0]))
+        wordlist = rec["textInfo"].get("wordlist")
+        if wordlist is None:
+            stories.append((utilFJML.get_story(rec), len(wordlists)))
+        wordlists.append(wordlist)
+    if stories:
+        if not nlp:
+            print("Loading", utilFJML.SPACY_MODEL, "with the", PROFILE, "profile")
+            nlp = utilFJML.load_nlp(PROFILE)
+        for doc, ka in nlp.pipe(stories, as_tuples=True):
+            wordlists[ka] = " ".join(utilFJML.get_wordlist(doc))
+    return Y, wordlists
+
+
+def get_start():
+    """ returns the Scorer a new history starts from and the number of cases it was estimated on: MODEL_DIR_NAME if it 
+    exists, otherwise zero coefficients over N_HASH_FEATURES hashed features """
+    if MODEL_DIR_NAME and os.path.exists(MODEL_DIR_NAME):
+        scorer = modelFJML.load_model(MODEL_DIR_NAME)
+        if scorer.coef.shape[0] != len(scorer.classes) or scorer.classes.min() < 0 or scorer.classes.max() >= N_MODE:
+            raise ValueError("The model in " + MODEL_DIR_NAME + " does not have one coefficient row for each mode")
+        return scorer, scorer.meta.get("cases", 0)
+    vectorizer = make_pipeline(HashingVectorizer(n_features=N_HASH_FEATURES, alternate_sign=False, norm=None),
+                               TfidfTransformer(use_idf=False))
+    vectorizer.fit([""])   # no idf weights: this only sets the number of features
+    empty = types.SimpleNamespace(classes_=np.arange(N_MODE), coef_=np.zeros((N_MODE, N_HASH_FEATURES)),
+                                  intercept_=np.zeros(N_MODE))
+    meta, arrays = modelFJML.get_arrays(vectorizer, empty)
+    return modelFJML.Scorer(meta, **arrays), 0
+
+
+def get_new_model(scorer, ncases):
+    """ returns an SGDClassifier which continues from the coefficients of scorer as if it had seen ncases cases """
+    model = SGDClassifier(loss="hinge", alpha=ALPHA, random_state=SEED)
+    model.coef_ = np.zeros((N_MODE, scorer.meta["n_features"]))
+    model.intercept_ = np.zeros(N_MODE)
+    model.coef_[scorer.classes] = scorer.coef
+    model.intercept_[scorer.classes] = scorer.intercept
+    model.t_ = ncases + 1.0   # partial_fit starts with t_ = 1
+    return model
+
+
+def load_version(version):
+    """ returns the Scorer and SGDClassifier of version """
+    dirname = os.path.join(HISTORY_DIR, version)
+    scorer = modelFJML.load_model(dirname)
+    with open(os.path.join(dirname, STATE_PFILE_NAME), "rb") as fin:
+        model = pickle.load(fin)
+    model.coef_ = np.array(scorer.coef)   # a writable copy of the memory-mapped coefficients
+    return scorer, model
+
+
+def get_matrix(scorer, wordlists):
+    """ returns the sparse matrix of the features of wordlists """
+    rows, cols, weights = scorer.get_features(wordlists)
+    return scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(len(wordlists), scorer.meta["n_features"]))
+
+
+def fold_in(scorer, model, Y, wordlists, seed):
+    """ updates model with N_EPOCHS passes of partial_fit over the new cases, shuffled in each pass """
+    X = get_matrix(scorer, wordlists)
+    Y = np.array(Y, dtype=np.int64)
+    rng = np.random.RandomState(seed)
+    for kep in range(N_EPOCHS):
+        order = rng.permutation(len(Y))
+        model.partial_fit(X[order], Y[order], classes=np.arange(N_MODE))
+
+
+def get_accuracy(scorer, model=None):
+    """ returns the accuracy on the cases in TEST_FILE_NAME of model over the features of scorer, or of scorer itself if
+    model is None """
+    global test_cases
+    if not test_cases:
+        test_cases = read_cases(TEST_FILE_NAME)
+    Y, wordlists = test_cases
+    if model is None:
+        mat = evalFJML.evaluate(scorer, wordlists, Y, N_MODE)[0]
+    else:
+        mat = evalFJML.evaluate(model, get_matrix(scorer, wordlists), Y, N_MODE)[0]
+    return evalFJML.get_scores(mat)["accuracy"]
+
+
+def save_version(scorer, model, entry):
+    """ writes the model to the directory of the version in entry, adds entry to the history and makes the version
+    current """
+    dirname = os.path.join(HISTORY_DIR, entry["version"])
+    meta = dict(scorer.meta, n_classes=N_MODE, cases=entry["total_cases"])
+    modelFJML.save_model(dirname, meta, {"vocab": scorer.vocab, "idf": scorer.idf, "coef": model.coef_,
+                                         "intercept": model.intercept_, "classes": model.classes_})
+    coef, model.coef_ = model.coef_, None   # saved in coef.npy
+    with open(os.path.join(dirname, STATE_PFILE_NAME), "wb") as fout:
+        pickle.dump(model, fout)
+    model.coef_ = coef
+    with open(os.path.join(HISTORY_DIR, HISTORY_FILE_NAME), "a") as fout:
+        fout.write(json.dumps(entry, sort_keys=True) + "\n")
+    set_current(entry["version"])
+
+
+def show_history():
+    """ lists the versions; the current version is marked with * """
+    current = get_current()
+    print("{:>8s}  {:>8s}  {:>19s}  {:>7s}  {:>7s}  {:>8s}  {:s}".format("version", "parent", "date", "cases", "total", "accuracy", "files"))
+    for entry in read_history():
+        print("{:>7s}{:s}  {:>8s}  {:>19s}  {:7d}  {:7d}  {:>8s}  {:s}".format(entry["version"],
+                "*" if entry["version"] == current else " ", entry["parent"] or "-", entry["date"], entry["cases"],
+                entry["total_cases"], "{:.2f}%".format(entry["accuracy"]*100) if entry.get("accuracy") is not None else "-",
+                " ".join(os.path.basename(fl["name"]) for fl in entry["files"])))
+
+
+for cmdopt in sys.argv:
+    if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+        theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+        if cmdopt == "-f":
+            FILE_NAMES = [theopt]
+        elif cmdopt == "-fl":
+            FILE_NAMES = [line[:-1] for line in open(theopt, "r") if line.strip()]
+        elif cmdopt == "-hd":
+            HISTORY_DIR = theopt
+        elif cmdopt == "-rb":
+            ROLLBACK_VERSION = theopt
+        elif cmdopt == "-ep":
+            N_EPOCHS = int(theopt)
+        elif cmdopt == "-tf":
+            TEST_FILE_NAME = theopt
+        elif cmdopt == "-md":
+            MODEL_DIR_NAME = None if theopt.lower() == "none" else theopt
+        elif cmdopt == "-hv":
+            N_HASH_FEATURES = int(theopt)
+        elif cmdopt == "-p":
+            PROFILE = theopt
+    elif cmdopt.startswith('-'):
+        print("Unrecognized option: " + cmdopt, end=" ")
+        try:
+            print(sys.argv[sys.argv.index(cmdopt) + 1])
+        except:
+            print()
+
+os.makedirs(HISTORY_DIR, exist_ok=True)
+history = read_history()
+current = get_current()
+nlp = None
+test_cases = None
+
+if ROLLBACK_VERSION:
+    if ROLLBACK_VERSION not in [entry["version"] for entry in history]:
+        print("Version", ROLLBACK_VERSION, "is not in", HISTORY_DIR)
+        sys.exit(1)
+    set_current(ROLLBACK_VERSION)
+    print("Rolled back from", current, "to", ROLLBACK_VERSION)
+
+elif FILE_NAMES:
+    t0 = time.time()
+    lineage = get_lineage(history, current)
+    folded = {fl["sha1"]: entry["version"] for entry in lineage for fl in entry["files"]}
+    Y, wordlists, files = [], [], []
+    for filename in FILE_NAMES:
+        sha1 = get_file_hash(filename)
+        if sha1 in folded:
+            print("Skipping", filename + ": already in", folded[sha1])
+            continue
+        print("Reading", filename)
+        Yfile, wordfile = read_cases(filename)
+        Y.extend(Yfile)
+        wordlists.extend(wordfile)
+        files.append({"name": filename, "sha1": sha1, "cases": len(Yfile)})
+        folded[sha1] = "this update"
+
+    if not Y:
+        print("No new labelled cases")
+    else:
+        if current:
+            scorer, model = load_version(current)
+            ncases, start = lineage[-1]["total_cases"], current
+            if TEST_FILE_NAME:
+                print("Accuracy of {:s}: {:.2f}%".format(current, get_accuracy(scorer, model)*100))
+        else:
+            scorer, ncases = get_start()
+            model = get_new_model(scorer, ncases)
+            start = MODEL_DIR_NAME if MODEL_DIR_NAME and os.path.exists(MODEL_DIR_NAME) else None
+            print("Starting from", start or "an empty model over {:d} hashed features".format(N_HASH_FEATURES))
+            if TEST_FILE_NAME and start:
+                print("Accuracy of {:s}: {:.2f}%".format(start, get_accuracy(scorer)*100))
+        version = "v{:04d}".format(len(history) + 1)
+        fold_in(scorer, model, Y, wordlists, SEED + len(history) + 1)
+        entry = {"version": version, "parent": current, "date": " ".join(utilFJML.get_date_time()), "files": files,
+                 "cases": len(Y), "total_cases": ncases + len(Y), "epochs": N_EPOCHS,
+                 "accuracy": get_accuracy(scorer, model) if TEST_FILE_NAME else None}
+        if not current:
+            entry["start"] = start
+        if TEST_FILE_NAME:
+            print("Accuracy of {:s}: {:.2f}%".format(version, entry["accuracy"]*100))
+        save_version(scorer, model, entry)
+        print("{:d} cases from {:d} files folded into {:s} as {:s} in {:.2f} sec".format(len(Y), len(files),
+                start or "an empty model", version, time.time() - t0))
+
+show_history()
+print("Finished")
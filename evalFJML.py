@@ -0,0 +1,231 @@
+"""
+evalFJML.py
+
+Evaluation of the FJTY filter models: classifies a set of cases with a single call to the model, builds the
+classification (confusion) matrix with NumPy, and computes per-category precision, recall and F1 along with the
+"codeable vs not" collapse of the categories. The results are available as the text report used by
+FJTYFilt_estimator.py and as a JSON-compatible dictionary, so runs can be tracked over time.
+
+TO RUN PROGRAM:
+
+python3 evalFJML.py -wf <filename> [optional command pairs]
+
+evaluates a model on the labelled cases -- records with a "mode" field -- in a wordlist file in the format produced by
+FJTYFilt_make_wordlists.py, prints the report, and optionally writes it as JSON
+
+    -wf INPUT_FILE_NAME    : labelled wordlist file
+    -md MODEL_DIR_NAME     : model directory (see modelFJML.py). Default: use the pickles
+    -vp VECTORZ_PFILE_NAME : pickled vectorizer. Default: save-vectorizer-Mk2.p
+    -mp MODEL_PFILE_NAME   : pickled model. Default: save-lin_clf-Mk2.p
+    -o JSON_FILE_NAME      : also write the report as JSON. Default: do not write file
+
+Programmer: Philip A. Schrodt <schrodt735@gmail.com>
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+REVISION HISTORY:
+18-Oct-2026:	Initial version
+=========================================================================================================
+"""
+import json
+import sys
+import time
+
+import numpy as np
+
+LABELS = ["codeable", "sports", "culture/entertainment", "business/finance", "opinion", "crime", "accidents",
+        "natural disaster", "open", "no codeable content"]
+
+N_MODE = 10  # maximum number of unique modes
+
+
+def get_classmat(Y, preds, n_mode=N_MODE):
+    """ returns the n_mode x n_mode classification matrix: rows are the true modes and columns the predictions """
+    Y, preds = np.asarray(Y, dtype=np.int64), np.asarray(preds, dtype=np.int64)
+    return np.bincount(Y * n_mode + preds, minlength=n_mode * n_mode).reshape(n_mode, n_mode)
+
+
+def evaluate(model, X, Y, n_mode=N_MODE):
+    """ classifies all of the cases in X with a single call to model.predict() and returns the classification matrix
+    and the time used by the prediction """
+    t0 = time.time()
+    preds = model.predict(X)
+    dt = time.time() - t0
+    return get_classmat(Y, preds, n_mode), dt
+
+
+def get_ratio(num, den):
+    """ num/den, with 0.0 where den is 0 """
+    num, den = np.asarray(num, dtype=float), np.asarray(den, dtype=float)
+    return np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+
+
+def get_prf(tp, npred, ntrue):
+    """ returns the precision, recall and F1 given the true positives and the numbers of predicted and true cases """
+    precision, recall = get_ratio(tp, npred), get_ratio(tp, ntrue)
+    return precision, recall, get_ratio(2 * precision * recall, precision + recall)
+
+
+def get_scores(classmat, labels=LABELS):
+    """ returns a JSON-compatible dictionary of the scores for a classification matrix: the overall accuracy, the
+    precision, recall, F1 and support of each category, the macro and weighted F1, and the same scores for the
+    collapse of the categories into codeable (mode 0) and not codeable (all other modes). Proportions are not
+    percentages. """
+    classmat = np.asarray(classmat)
+    ncase = int(classmat.sum())
+    support = classmat.sum(axis=1)
+    tp = np.diag(classmat)
+    precision, recall, f1 = get_prf(tp, classmat.sum(axis=0), support)
+    codemat = np.array([[classmat[0, 0], classmat[0, 1:].sum()],
+                        [classmat[1:, 0].sum(), classmat[1:, 1:].sum()]])
+    cprecision, crecall, cf1 = get_prf(np.diag(codemat), codemat.sum(axis=0), codemat.sum(axis=1))
+    return {
+        "cases": ncase,
+        "accuracy": float(get_ratio(tp.sum(), ncase)),
+        "macro_f1": float(f1[support > 0].mean()) if (support > 0).any() else 0.0,
+        "weighted_f1": float(get_ratio((f1 * support).sum(), ncase)),
+        "classes": [{"mode": ka, "label": labels[ka], "support": int(support[ka]), "precision": float(precision[ka]),
+                     "recall": float(recall[ka]), "f1": float(f1[ka])} for ka in range(len(classmat))],
+        "codeable": {"matrix": codemat.tolist(), "accuracy": float(get_ratio(np.trace(codemat), ncase)),
+                     "labels": ["codeable (mode 0)", "not codeable (1-9)"], "precision": cprecision.tolist(),
+                     "recall": crecall.tolist(), "f1": cf1.tolist()},
+        "matrix": classmat.tolist(),
+        }
+
+
+def get_summary(scores):
+    """ returns the mean, standard deviation, minimum and maximum across a list of get_scores() results of the
+    accuracy, the macro F1 and the precision, recall and F1 of each category; categories with no cases in a set are
+    left out of its statistics """
+    def get_stats(values):
+        if not values:
+            return None
+        return {"mean": float(np.mean(values)), "stddev": float(np.std(values, ddof=1)) if len(values) > 1 else 0.0,
+                "min": float(min(values)), "max": float(max(values)), "n": len(values)}
+    summary = {"sets": len(scores),
+               "accuracy": get_stats([sc["accuracy"] for sc in scores]),
+               "macro_f1": get_stats([sc["macro_f1"] for sc in scores]),
+               "codeable_accuracy": get_stats([sc["codeable"]["accuracy"] for sc in scores]),
+               "classes": []}
+    for ka, cls in enumerate(scores[0]["classes"] if scores else []):
+        present = [sc["classes"][ka] for sc in scores if sc["classes"][ka]["support"] > 0]
+        stats = {key: get_stats([pc[key] for pc in present]) for key in ["precision", "recall", "f1"]}
+        summary["classes"].append(dict(mode=ka, label=cls["label"], **stats))
+    return summary
+
+
+def format_training(classmat):
+    """ returns the lines of the training set report: the classification matrix and the accuracy of each category """
+    lines = ['Training set']
+    for ka, kv in enumerate(classmat):
+        tot = kv.sum()
+        lines.append(str(ka) + ' | ' + "".join("{:4d}  ".format(num) for num in kv) +
+                     '  {:.2f}'.format(float(kv[ka]*100)/tot if tot > 0 else 0.0))
+    return lines
+
+
+def format_test(classmat, labels=LABELS):
+    """ returns the lines of the test set report: the classification matrix followed by the number and percentage of
+    the cases in each category, the accuracy in classifying the category, and the accuracy in classifying it as
+    codeable or not """
+    kt = classmat.sum()
+    lines = ['Test set']
+    for ka, kv in enumerate(classmat):
+        tot, main, nnc = kv.sum(), kv[ka], kv[1:].sum()
+        line = "{:>22s} | ".format(labels[ka]) + "".join("{:4d}  ".format(num) for num in kv)
+        if tot > 0:
+            line += ' {:4d} ({:6.2f}%)  {:6.2f}%'.format(tot, float(tot*100)/kt, float(main*100)/tot)
+            line += '  {:6.2f}%'.format(float((main if ka == 0 else nnc)*100)/tot)
+        else:
+            line += ' ---'
+        lines.append(line)
+    return lines
+
+
+def format_scores(scores):
+    """ returns the lines of the precision/recall/F1 report for a get_scores() result """
+    lines = ["{:>22s} |  {:>7s}  {:>7s}  {:>7s}  {:>6s}".format("", "prec", "recall", "F1", "cases")]
+    for cls in scores["classes"]:
+        if cls["support"] > 0:
+            lines.append("{:>22s} |  {:6.2f}%  {:6.2f}%  {:6.2f}%  {:6d}".format(cls["label"], cls["precision"]*100,
+                        cls["recall"]*100, cls["f1"]*100, cls["support"]))
+    for ka, label in enumerate(scores["codeable"]["labels"]):
+        lines.append("{:>22s} |  {:6.2f}%  {:6.2f}%  {:6.2f}%  {:6d}".format(label, scores["codeable"]["precision"][ka]*100,
+                    scores["codeable"]["recall"][ka]*100, scores["codeable"]["f1"][ka]*100,
+                    sum(scores["codeable"]["matrix"][ka])))
+    lines.append("Overall: accuracy {:.2f}%  codeable/not {:.2f}%  macro F1 {:.2f}%  weighted F1 {:.2f}%".format(
+                scores["accuracy"]*100, scores["codeable"]["accuracy"]*100, scores["macro_f1"]*100, scores["weighted_f1"]*100))
+    return lines
+
+
+def format_summary(summary):
+    """ returns the lines of the report for a get_summary() result: the statistics of the recall -- the accuracy in
+    classifying each category -- followed by those of the overall accuracy """
+    lines = ["{:>22s} |  {:>7s}  {:>7s}  {:>7s}  {:>7s}".format("", "mean", "stddev", "min", "max")]
+    def format_stats(label, stats):
+        if stats:
+            lines.append("{:>22s} |  {:6.2f}%  {:6.2f}%  {:6.2f}%  {:6.2f}%".format(label, stats["mean"]*100,
+                        stats["stddev"]*100, stats["min"]*100, stats["max"]*100))
+    for cls in summary["classes"]:
+        format_stats(cls["label"], cls["recall"])
+    format_stats("Accuracy", summary["accuracy"])
+    format_stats("Codeable/not", summary["codeable_accuracy"])
+    format_stats("Macro F1", summary["macro_f1"])
+    return lines
+
+
+if __name__ == "__main__":
+    import modelFJML
+    import utilFJML
+
+    CMD_OPTIONS = ["-wf", "-md", "-vp", "-mp", "-o"]
+
+    INPUT_FILE_NAME = None
+    MODEL_DIR_NAME = None
+    VECTORZ_PFILE_NAME = "save-vectorizer-Mk2.p"
+    MODEL_PFILE_NAME = "save-lin_clf-Mk2.p"
+    JSON_FILE_NAME = None
+
+    for cmdopt in sys.argv:
+        if cmdopt.startswith('-') and cmdopt in CMD_OPTIONS:
+            theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+            if cmdopt == "-wf":
+                INPUT_FILE_NAME = theopt
+            elif cmdopt == "-md":
+                MODEL_DIR_NAME = theopt
+            elif cmdopt == "-vp":
+                VECTORZ_PFILE_NAME = theopt
+            elif cmdopt == "-mp":
+                MODEL_PFILE_NAME = theopt
+            elif cmdopt == "-o":
+                JSON_FILE_NAME = theopt
+        elif cmdopt.startswith('-'):
+            print("Unrecognized option: " + cmdopt, end=" ")
+            try:
+                print(sys.argv[sys.argv.index(cmdopt) + 1])
+            except:
+                print()
+
+    if not INPUT_FILE_NAME:
+        print("A labelled wordlist file (-wf) is required")
+        exit()
+
+    if MODEL_DIR_NAME:
+        scorer = modelFJML.load_model(MODEL_DIR_NAME)
+    else:
+        scorer = modelFJML.load_pickles(VECTORZ_PFILE_NAME, MODEL_PFILE_NAME)
+    Y, wordlists = [], []
+    for rec in utilFJML.read_file(INPUT_FILE_NAME):
+        if "mode" in rec:
+            Y.append(int(rec["mode"][0]))
+            wordlists.append(rec["textInfo"]["wordlist"])
+    classmat, dt = evaluate(scorer, wordlists, Y)
+    scores = get_scores(classmat)
+    print("Classified {:d} cases in {:.3f} sec".format(len(Y), dt))
+    for line in format_test(classmat) + format_scores(scores):
+        print(line)
+    if JSON_FILE_NAME:
+        with open(JSON_FILE_NAME, "w") as fout:
+            json.dump({"run": " ".join(utilFJML.get_date_time()), "input": INPUT_FILE_NAME,
+                       "model": MODEL_DIR_NAME or [VECTORZ_PFILE_NAME, MODEL_PFILE_NAME], "test": scores},
+                       fout, indent=2, sort_keys=True)
+    print("Finished")
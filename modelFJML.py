@@ -0,0 +1,412 @@
+"""
+modelFJML.py
+
+Saves the TfidfVectorizer and LinearSVC estimated by FJTYFilt_estimator.py as flat NumPy arrays and loads them as a
+scorer. Unlike the pickles, the arrays do not depend on the sklearn version, and they are memory-mapped when loaded, so
+a model loads in a few milliseconds. The scorer only uses NumPy, so programs which classify with a model directory do 
+not need to import sklearn.
+
+A model directory contains
+
+    meta.json       vectorizer settings, number of features and classes and, if known, the number of cases the model
+                    was estimated on
+    vocab.npy       the vocabulary as UTF-8 terms separated by newlines, in column order (uint8); empty for a 
+                    HashingVectorizer + TfidfTransformer model, where the column is the MurmurHash3 of the term
+    idf.npy         idf weights (float64, n_features)
+    coef.npy        SVM coefficients (float64, n_classes x n_features)
+    intercept.npy   SVM intercepts (float64, n_classes)
+    classes.npy     class labels (int64, n_classes)
+    calibration.npy optional: sigmoid calibration of the margins of each class (float64, n_classes x 2); see 
+                    fit_calibration()
+
+TO RUN PROGRAM:
+
+python3 modelFJML.py [optional command pairs]
+
+exports the pickled vectorizer and model to a model directory, then checks that the predictions of the loaded model
+match the pickles on the cases in INPUT_FILE_NAME
+
+    -vp VECTORZ_PFILE_NAME : pickled vectorizer. Default: save-vectorizer-Mk2.p
+    -mp MODEL_PFILE_NAME   : pickled model. Default: save-lin_clf-Mk2.p
+    -md MODEL_DIR_NAME     : model directory. Default: FJTY_Model-Mk2
+    -wf INPUT_FILE_NAME    : wordlist file used for the check. Default: demo-REUT-20-02-25-wordlists.jsonl
+
+Programmer: Philip A. Schrodt <schrodt735@gmail.com>
+This code is covered under the MIT license: http://opensource.org/licenses/MIT
+
+REVISION HISTORY:
+18-Oct-2026:	Initial version
+18-Oct-2026:	Scorer uses only NumPy
+18-Oct-2026:	HashingVectorizer + TfidfTransformer models
+18-Oct-2026:	load_model() follows the current version of a model history
+18-Oct-2026:	calibrated probabilities and prediction confidence
+18-Oct-2026:	vectorizers pickled by older versions of sklearn
+18-Oct-2026:	Scorer reads the memory-mapped coefficients without copying them
+18-Oct-2026:	get_arrays() and save_model() for programs which write model directories themselves
+18-Oct-2026:	export rejects any vectorizer setting Scorer does not implement, found with get_params()
+=========================================================================================================
+"""
+import itertools
+import json
+import os
+import pickle
+import re
+import struct
+import sys
+import time
+
+import numpy as np
+
+import utilFJML
+
+FORMAT_VERSION = 1
+
+VECTORIZER_SETTINGS = ["lowercase", "token_pattern", "norm", "use_idf", "smooth_idf", "sublinear_tf", "binary"]
+# settings used only by fit(), or saved or checked separately by get_arrays()
+FIT_SETTINGS = ["max_df", "min_df", "max_features", "vocabulary", "n_features", "alternate_sign"]
+
+HASH_CACHE_SIZE = 1 << 20   # maximum number of hashed terms kept by HashColumns
+
+FAST_TOKEN_PATTERNS = {r"(?u)\b\w\w+\b": r"\w\w+"}  # equivalent patterns: a greedy \w\w+ only starts and ends at \b
+
+
+class Columns(dict):
+    """ term -> column dict which returns -1 for terms which are not in the vocabulary """
+
+    def __missing__(self, term):
+        return -1
+
+
+class HashColumns(dict):
+    """ term -> column dict for a hashed feature space: the columns are computed as needed and cached """
+
+    def __init__(self, n_features):
+        super().__init__()
+        self.n_features = n_features
+
+    def __missing__(self, term):
+        h = murmurhash3_32(term.encode("utf-8"))
+        col = (2147483647 - (self.n_features - 1)) % self.n_features if h == -2147483648 else abs(h) % self.n_features
+        if len(self) < HASH_CACHE_SIZE:
+            self[term] = col
+        return col
+
+
+def murmurhash3_32(data, seed=0):
+    """ signed 32-bit MurmurHash3 (x86_32) of the bytes data: the hash used by sklearn's HashingVectorizer """
+    c1, c2 = 0xcc9e2d51, 0x1b873593
+    h = seed & 0xffffffff
+    nblocks = len(data) // 4
+    for k in struct.unpack_from("<{:d}I".format(nblocks), data):
+        k = (k * c1) & 0xffffffff
+        k = ((k << 15) | (k >> 17)) & 0xffffffff
+        h ^= (k * c2) & 0xffffffff
+        h = ((h << 13) | (h >> 19)) & 0xffffffff
+        h = (h * 5 + 0xe6546b64) & 0xffffffff
+    k = 0
+    for kb, byte in enumerate(data[nblocks * 4:]):
+        k |= byte << (8 * kb)
+    if len(data) % 4:
+        k = (k * c1) & 0xffffffff
+        k = ((k << 15) | (k >> 17)) & 0xffffffff
+        h ^= (k * c2) & 0xffffffff
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & 0xffffffff
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & 0xffffffff
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+class Scorer:
+    """ tf/idf vectorizer and linear classifier rebuilt from the arrays in a model directory. This uses only NumPy: the 
+    tokens of a batch of cases are looked up in a term -> column dict, then the tf/idf weights and the margins 
+    coef @ x + intercept of all of the cases are computed with array operations """
+
+    def __init__(self, meta, vocab, idf, coef, intercept, classes, calibration=None):
+        self.meta, self.vocab = meta, vocab
+        self.idf, self.coef, self.intercept, self.classes = idf, coef, intercept, classes
+        self.calibration = calibration
+        if meta.get("hashing"):
+            self.columns = HashColumns(meta["n_features"])
+        else:
+            terms = vocab.tobytes().decode("utf-8").split("\n") if len(vocab) else []
+            self.columns = Columns(zip(terms, range(len(terms))))
+        self.token_re = re.compile(FAST_TOKEN_PATTERNS.get(meta["token_pattern"], meta["token_pattern"]))
+
+    def get_features(self, wordlists):
+        """ returns the rows, columns and normalized tf/idf weights of the terms in wordlists, sorted by row """
+        if self.meta["lowercase"]:
+            wordlists = [wordlist.lower() for wordlist in wordlists]
+        tokens = [self.token_re.findall(wordlist) for wordlist in wordlists]
+        cols = np.fromiter(map(self.columns.__getitem__, itertools.chain.from_iterable(tokens)), dtype=np.int64)
+        rows = np.repeat(np.arange(len(tokens), dtype=np.int64), [len(toks) for toks in tokens])
+        n_features = max(self.meta["n_features"], 1)
+        keys, counts = np.unique((rows * n_features + cols)[cols >= 0], return_counts=True)
+        rows, cols = keys // n_features, keys % n_features
+        weights = counts.astype(np.float64)
+        if self.meta["binary"]:
+            weights[:] = 1.0
+        elif self.meta["sublinear_tf"]:
+            weights = np.log(weights) + 1
+        if self.meta["use_idf"]:
+            weights *= self.idf[cols]
+        if self.meta["norm"] == "l2":
+            norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(tokens)))
+        elif self.meta["norm"] == "l1":
+            norms = np.bincount(rows, weights=np.abs(weights), minlength=len(tokens))
+        else:
+            norms = np.ones(len(tokens))
+        norms[norms == 0] = 1.0
+        return rows, cols, weights / norms[rows]
+
+    def decision_function(self, wordlists):
+        """ returns the n_cases x n_classes SVM margins of wordlists """
+        rows, cols, weights = self.get_features(wordlists)
+        scores = np.empty((len(wordlists), self.coef.shape[0]))
+        for kc in range(self.coef.shape[0]):   # gathers the terms from each row of coef, so a memory-mapped coef is not copied
+            scores[:, kc] = np.bincount(rows, weights=self.coef[kc, cols] * weights, minlength=len(wordlists))
+        return scores + self.intercept
+
+    def predict(self, wordlists):
+        """ returns the predicted class of each of wordlists """
+        scores = self.decision_function(wordlists)
+        if scores.shape[1] == 1:   # binary model: a single column of margins for classes[1]
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+    def predict_confidence(self, wordlists):
+        """ see get_confidence() """
+        return get_confidence(self.decision_function(wordlists), self.classes, self.calibration)
+
+
+class PickleScorer:
+    """ the pickled vectorizer and model with the same interface as Scorer """
+
+    def __init__(self, vectorizer, model, calibration=None):
+        self.vectorizer, self.model = vectorizer, model
+        self.classes = model.classes_
+        self.calibration = calibration
+
+    def transform(self, wordlists):
+        return self.vectorizer.transform(wordlists)
+
+    def decision_function(self, wordlists):
+        scores = self.model.decision_function(self.transform(wordlists))
+        return scores.reshape(len(scores), -1)
+
+    def predict(self, wordlists):
+        return self.model.predict(self.transform(wordlists))
+
+    def predict_confidence(self, wordlists):
+        return get_confidence(self.decision_function(wordlists), self.classes, self.calibration)
+
+
+def get_sigmoid(z):
+    """ 1 / (1 + exp(-z)) without overflow """
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+
+def fit_sigmoid(margins, targets, maxiter=100):
+    """ returns the (a, b) of Platt scaling, P(target | margin) = 1 / (1 + exp(-(a * margin + b))), fitted by Newton's
+    method with backtracking; the targets are smoothed by the number of positive and negative cases as in Platt (1999)
+    """
+    margins, targets = np.asarray(margins, dtype=np.float64), np.asarray(targets, dtype=bool)
+    npos = targets.sum()
+    nneg = len(targets) - npos
+    t = np.where(targets, (npos + 1.0) / (npos + 2.0), 1.0 / (nneg + 2.0))
+    def get_loss(a, b):
+        z = a * margins + b
+        return np.sum(np.logaddexp(0, z) - t * z)
+    a, b = 0.0, np.log((npos + 1.0) / (nneg + 1.0))
+    loss = get_loss(a, b)
+    for kiter in range(maxiter):
+        p = get_sigmoid(a * margins + b)
+        grad = np.array([np.dot(p - t, margins), np.sum(p - t)])
+        w = p * (1 - p)
+        hess = np.array([[np.dot(w, margins * margins) + 1e-12, np.dot(w, margins)],
+                         [np.dot(w, margins), np.sum(w) + 1e-12]])
+        step = np.linalg.solve(hess, grad)
+        stepsize = 1.0
+        while stepsize > 1e-10:
+            newloss = get_loss(a - stepsize * step[0], b - stepsize * step[1])
+            if newloss <= loss + 1e-4 * stepsize * np.dot(grad, -step):
+                break
+            stepsize /= 2
+        else:
+            break
+        a, b, loss = a - stepsize * step[0], b - stepsize * step[1], newloss
+        if np.abs(stepsize * step).max() < 1e-8:
+            break
+    return a, b
+
+
+def fit_calibration(margins, Y, classes):
+    """ returns the n_classes x 2 calibration array: the Platt scaling (a, b) of each column of margins, fitted to 
+    whether Y is the class of the column. The margins should come from cases which were not used to estimate the
+    model, for example the test cases of FJTYFilt_estimator.py """
+    margins, Y = np.asarray(margins, dtype=np.float64), np.asarray(Y)
+    return np.array([fit_sigmoid(margins[:, kc], Y == cls) for kc, cls in enumerate(classes)])
+
+
+def get_probabilities(margins, calibration):
+    """ returns the calibrated probabilities of each class: the sigmoid of each column, normalized so each row sums 
+    to 1 """
+    probs = get_sigmoid(margins * calibration[:, 0] + calibration[:, 1])
+    total = probs.sum(axis=1, keepdims=True)
+    total[total == 0] = 1.0
+    return probs / total
+
+
+def get_confidence(margins, classes, calibration=None):
+    """ returns the predicted classes, their margins, the gap between the two largest margins and -- if there is a
+    calibration, otherwise None -- the calibrated probability of the predicted class """
+    if margins.shape[1] == 1:   # binary model
+        margins = np.hstack([-margins, margins])
+    kpred = margins.argmax(axis=1)
+    rows = np.arange(len(margins))
+    top2 = np.partition(margins, -2, axis=1)[:, -2:] if margins.shape[1] > 1 else np.hstack([margins, margins])
+    probs = None if calibration is None else get_probabilities(margins, calibration)[rows, kpred]
+    return np.asarray(classes)[kpred], margins[rows, kpred], top2[:, 1] - top2[:, 0], probs
+
+
+def upgrade_vectorizer(vectorizer):
+    """ adds the attributes used by the current sklearn to a TfidfVectorizer or TfidfTransformer pickled by an older 
+    version -- such as the models in FJTY_SVM_Models.zip -- which keeps the tf/idf settings in vectorizer._tfidf and 
+    the idf weights as the diagonal matrix _idf_diag; returns vectorizer """
+    tfidfs = [step[1] for step in vectorizer.steps] if hasattr(vectorizer, "steps") else [vectorizer]
+    if hasattr(vectorizer, "_tfidf"):
+        for setting in ["norm", "use_idf", "smooth_idf", "sublinear_tf"]:
+            if setting not in vars(vectorizer):
+                setattr(vectorizer, setting, getattr(vectorizer._tfidf, setting))
+        tfidfs.append(vectorizer._tfidf)
+    for tfidf in tfidfs:
+        if hasattr(tfidf, "_idf_diag") and not hasattr(tfidf, "idf_"):
+            tfidf.idf_ = np.asarray(tfidf._idf_diag.diagonal(), dtype=np.float64)
+    return vectorizer
+
+
+def get_changed_settings(estimator):
+    """ returns the names of the parameters of the vectorizer or transformer estimator, other than VECTORIZER_SETTINGS 
+    and FIT_SETTINGS, which differ from their defaults: Scorer does not implement them, so they cannot be exported """
+    defaults = type(estimator)().get_params()
+    return [name for name, value in sorted(estimator.get_params().items()) 
+            if name not in VECTORIZER_SETTINGS + FIT_SETTINGS and value != defaults.get(name)]
+
+
+def get_arrays(vectorizer, model):
+    """ returns the meta dictionary and the arrays of a model directory for the fitted TfidfVectorizer -- or 
+    HashingVectorizer + TfidfTransformer pipeline -- and linear model """
+    upgrade_vectorizer(vectorizer)
+    if hasattr(vectorizer, "steps"):
+        hasher, tfidf = vectorizer.steps[0][1], vectorizer.steps[-1][1]
+        if len(vectorizer.steps) != 2 or not hasattr(hasher, "n_features") or hasher.alternate_sign or hasher.norm:
+            raise ValueError("Only a HashingVectorizer(alternate_sign=False, norm=None) + TfidfTransformer pipeline can be exported")
+        tokenizer, n_features, vocab = hasher, hasher.n_features, b""
+    else:
+        tokenizer, tfidf = vectorizer, vectorizer
+        terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+        n_features, vocab = len(terms), "\n".join(terms).encode("utf-8")
+    changed = get_changed_settings(tokenizer) + (get_changed_settings(tfidf) if tfidf is not tokenizer else [])
+    if changed:
+        raise ValueError("Only the default analyzer and settings, apart from " + ", ".join(VECTORIZER_SETTINGS) + 
+                         ", can be exported; the vectorizer sets " + ", ".join(changed))
+    meta = {setting: getattr(tfidf if hasattr(tfidf, setting) else tokenizer, setting) for setting in VECTORIZER_SETTINGS}
+    meta.update({"format": FORMAT_VERSION, "n_features": n_features, "n_classes": len(model.classes_),
+                 "hashing": tokenizer is not tfidf})
+    idf = tfidf.idf_ if tfidf.use_idf else np.ones(n_features)
+    return meta, {"vocab": np.frombuffer(vocab, dtype=np.uint8), "idf": np.asarray(idf, dtype=np.float64),
+                  "coef": np.ascontiguousarray(model.coef_, dtype=np.float64),
+                  "intercept": np.asarray(model.intercept_, dtype=np.float64),
+                  "classes": np.asarray(model.classes_, dtype=np.int64)}
+
+
+def save_model(dirname, meta, arrays, calibration=None):
+    """ writes meta, the arrays returned by get_arrays() and the calibration if there is one to the directory dirname """
+    os.makedirs(dirname, exist_ok=True)
+    with open(os.path.join(dirname, "meta.json"), "w") as fout:
+        fout.write(json.dumps(meta, indent=2, sort_keys=True) + "\n")
+    for name in ["vocab", "idf", "coef", "intercept", "classes"]:
+        np.save(os.path.join(dirname, name + ".npy"), arrays[name])
+    if calibration is not None:
+        np.save(os.path.join(dirname, "calibration.npy"), np.asarray(calibration, dtype=np.float64))
+    elif os.path.exists(os.path.join(dirname, "calibration.npy")):
+        os.remove(os.path.join(dirname, "calibration.npy"))   # from an earlier model
+
+
+def export_model(vectorizer, model, dirname, calibration=None, cases=None):
+    """ writes the fitted TfidfVectorizer -- or HashingVectorizer + TfidfTransformer pipeline -- and linear model, and 
+    the calibration if there is one, to the directory dirname. cases, the number of cases the model was estimated on,
+    is saved in meta.json if it is given """
+    meta, arrays = get_arrays(vectorizer, model)
+    if cases is not None:
+        meta["cases"] = cases
+    save_model(dirname, meta, arrays, calibration)
+
+
+def load_model(dirname, mmap=True):
+    """ returns a Scorer for the model directory dirname; the arrays are memory-mapped unless mmap is False. If dirname
+    is a model history written by FJTYFilt_update.py, the current version is loaded """
+    if os.path.exists(os.path.join(dirname, "current")):
+        with open(os.path.join(dirname, "current"), "r") as fin:
+            dirname = os.path.join(dirname, fin.read().strip())
+    with open(os.path.join(dirname, "meta.json"), "r") as fin:
+        meta = json.load(fin)
+    if meta["format"] != FORMAT_VERSION:
+        raise ValueError("Model directory " + dirname + " has format " + str(meta["format"]))
+    arrays = [np.load(os.path.join(dirname, name + ".npy"), mmap_mode="r" if mmap else None)
+              for name in ["vocab", "idf", "coef", "intercept", "classes"]]
+    calibration = None
+    if os.path.exists(os.path.join(dirname, "calibration.npy")):
+        calibration = np.load(os.path.join(dirname, "calibration.npy"))
+    return Scorer(meta, *arrays, calibration=calibration)
+
+
+def load_pickles(vectorizer_filename, model_filename, calibration_filename=None):
+    """ returns a PickleScorer for the pickled vectorizer and model, and the pickled calibration array if 
+    calibration_filename is not None """
+    with open(vectorizer_filename, "rb") as fvec, open(model_filename, "rb") as fmod:
+        scorer = PickleScorer(upgrade_vectorizer(pickle.load(fvec)), pickle.load(fmod))
+    if calibration_filename:
+        with open(calibration_filename, "rb") as fcal:
+            scorer.calibration = pickle.load(fcal)
+    return scorer
+
+
+if __name__ == "__main__":
+    vectorizer_filename, model_filename = "save-vectorizer-Mk2.p", "save-lin_clf-Mk2.p"
+    dirname, filename = "FJTY_Model-Mk2", "demo-REUT-20-02-25-wordlists.jsonl"
+    for cmdopt in sys.argv:
+        if cmdopt in ["-vp", "-mp", "-md", "-wf"]:
+            theopt = sys.argv[sys.argv.index(cmdopt) + 1]
+            if cmdopt == "-vp":
+                vectorizer_filename = theopt
+            elif cmdopt == "-mp":
+                model_filename = theopt
+            elif cmdopt == "-md":
+                dirname = theopt
+            elif cmdopt == "-wf":
+                filename = theopt
+
+    t0 = time.time()
+    pscorer = load_pickles(vectorizer_filename, model_filename)
+    print("Loaded pickles in {:.1f} msec".format((time.time() - t0) * 1000))
+    export_model(pscorer.vectorizer, pscorer.model, dirname)
+    print("Exported model to", dirname, "{:,d} bytes".format(sum(os.path.getsize(os.path.join(dirname, name))
+                                                               for name in os.listdir(dirname))))
+    t0 = time.time()
+    scorer = load_model(dirname)
+    print("Loaded model in {:.1f} msec".format((time.time() - t0) * 1000))
+
+    wordlists = [rec["textInfo"]["wordlist"] for rec in utilFJML.read_file(filename)]
+    nmiss = int((pscorer.predict(wordlists) != scorer.predict(wordlists)).sum())
+    maxdiff = np.abs(pscorer.decision_function(wordlists) - scorer.decision_function(wordlists)).max()
+    print("{:d} cases in {:s}: {:d} predictions differ; maximum margin difference {:.3g}".format(
+        len(wordlists), filename, nmiss, maxdiff))
+    for name, sc in [("pickles", pscorer), ("model directory", scorer)]:
+        t0 = time.time()
+        sc.predict(wordlists)
+        print("Time to classify using the {:s}: {:.1f} msec".format(name, (time.time() - t0) * 1000))
+    if nmiss:
+        sys.exit(1)
@@ -0,0 +1,70 @@
+""" checks that the sparse tf/idf path of FJTYFilt_estimator.py gives the same model and predictions as the dense
+matrices, using some of the cases in FJTY_training_wordlists.zip. Run with python3 -m pytest """
+import importlib
+import os
+import sys
+import zipfile
+
+import numpy as np
+import pytest
+
+import evalFJML
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAINING_ZIP = os.path.join(PACKAGE_DIR, "FJTY_training_wordlists.zip")
+TRAINING_FILES = ["AcciSix-wordlists.jsonl", "BusFinThree-wordlists.jsonl", "CovidEight-wordlists.jsonl"]
+
+
+@pytest.fixture(scope="module")
+def estimator(tmp_path_factory):
+    """ FJTYFilt_estimator imported in a directory with a file list of TRAINING_FILES """
+    pytest.importorskip("sklearn")
+    dirname = tmp_path_factory.mktemp("estimator")
+    with zipfile.ZipFile(TRAINING_ZIP) as fzip:
+        for filename in TRAINING_FILES:
+            fzip.extract("FJTY_training_wordlists/" + filename, dirname)
+    with open(os.path.join(dirname, "filt-estimator-filelist.txt"), "w") as fout:
+        fout.write("\n".join(TRAINING_FILES) + "\n")
+    cwd, argv = os.getcwd(), sys.argv
+    try:
+        os.chdir(dirname)
+        sys.argv = ["FJTYFilt_estimator.py"]
+        estimator = importlib.import_module("FJTYFilt_estimator")
+    finally:
+        os.chdir(cwd)
+        sys.argv = argv
+    estimator.FILE_PATH = os.path.join(str(dirname), "FJTY_training_wordlists")
+    return estimator
+
+
+@pytest.fixture(scope="module")
+def corpus(estimator):
+    return estimator.read_corpus()
+
+
+def test_check_dense(estimator, corpus):
+    Y, wordlists = corpus
+    X = estimator.get_vectorizer().fit_transform(wordlists)
+    assert estimator.scipy.sparse.issparse(X)
+    coefdiff, interdiff, npred = estimator.check_dense(X, Y)
+    assert coefdiff < 1e-6 and interdiff < 1e-6
+    assert npred == 0
+
+
+def test_experiment_split(estimator, corpus):
+    Y, wordlists = corpus
+    counter = estimator.get_counter()
+    Xcounts = counter.fit_transform(wordlists).tocsr()
+    estimator.init_experiment(Xcounts, Y, counter.get_feature_names_out())
+    train, test = estimator.get_stratified_split(0)
+    X, X_test, vocabulary, transformer = estimator.get_split(Xcounts, train, test)
+    vectorizer = estimator.get_vectorizer()   # the dense equivalent: fit to the training wordlists
+    dense = vectorizer.fit_transform([wordlists[ka] for ka in train]).toarray()
+    assert vectorizer.vocabulary_ == vocabulary
+    np.testing.assert_allclose(X.toarray(), dense, rtol=1e-12, atol=1e-15)
+    dense_test = vectorizer.transform([wordlists[ka] for ka in test]).toarray()
+    np.testing.assert_allclose(X_test.toarray(), dense_test, rtol=1e-12, atol=1e-15)
+    lin_clf = estimator.svm.LinearSVC(random_state=0).fit(X, Y[train])
+    sparse_mat, dt = evalFJML.evaluate(lin_clf, X_test, Y[test], estimator.N_MODE)
+    dense_mat, dt = evalFJML.evaluate(lin_clf, dense_test, Y[test], estimator.N_MODE)
+    np.testing.assert_array_equal(sparse_mat, dense_mat)
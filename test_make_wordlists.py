@@ -0,0 +1,55 @@
+""" checks that FJTYFilt_make_wordlists.py writes the same output with one and with two spaCy processes, with and
+without the wordlist cache. Run with python3 -m pytest; skipped if spaCy or utilFJML.SPACY_MODEL is not installed """
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import utilFJML
+
+SCRIPT_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "FJTYFilt_make_wordlists.py")
+STORIES_ZIP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "demo-REUT-20-02-25-stories.jsonl.zip")
+N_STORIES = 120
+
+
+@pytest.fixture(scope="module")
+def stories(tmp_path_factory):
+    spacy = pytest.importorskip("spacy")
+    try:
+        spacy.load(utilFJML.SPACY_MODEL)
+    except OSError:
+        pytest.skip(utilFJML.SPACY_MODEL + " is not installed")
+    dirname = tmp_path_factory.mktemp("wordlists")
+    with zipfile.ZipFile(STORIES_ZIP) as fzip:
+        fzip.extract("demo-REUT-20-02-25-stories.jsonl", dirname)
+    with open(os.path.join(dirname, "test-stories.jsonl"), "w") as fout:
+        for krec, rec in enumerate(utilFJML.read_file(os.path.join(dirname, "demo-REUT-20-02-25-stories.jsonl"))):
+            if krec >= N_STORIES:
+                break
+            fout.write(json.dumps(rec, indent=2, sort_keys=True) + "\n")
+    with open(os.path.join(dirname, "files.txt"), "w") as fout:
+        fout.write("test-stories.jsonl\n")
+    return dirname
+
+
+def make_wordlists(dirname, outname, nprocess, cachename="none"):
+    """ runs FJTYFilt_make_wordlists.py in dirname and returns the output file """
+    subprocess.run([sys.executable, SCRIPT_NAME, "-f", "files.txt", "-o", outname, "-bs", "8",
+                    "-np", str(nprocess), "-k", cachename], cwd=dirname, check=True, stdout=subprocess.DEVNULL)
+    with open(os.path.join(dirname, outname), "r") as fin:
+        return fin.read()
+
+
+def test_processes(stories):
+    serial = make_wordlists(stories, "np1-wordlists.jsonl", 1)
+    assert len(list(utilFJML.read_file(os.path.join(stories, "np1-wordlists.jsonl")))) == N_STORIES
+    assert make_wordlists(stories, "np2-wordlists.jsonl", 2) == serial
+
+
+def test_cache(stories):
+    serial = make_wordlists(stories, "np1-wordlists.jsonl", 1)
+    assert make_wordlists(stories, "cold-wordlists.jsonl", 2, "test.cache.sqlite") == serial
+    assert make_wordlists(stories, "warm-wordlists.jsonl", 2, "test.cache.sqlite") == serial
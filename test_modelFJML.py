@@ -0,0 +1,78 @@
+""" checks that the model directories written by modelFJML.export_model() give the same margins as the pickles, for the
+models in FJTY_SVM_Models.zip and for a model fitted with the installed sklearn. Run with python3 -m pytest """
+import os
+import pickle
+import warnings
+import zipfile
+
+import numpy as np
+import pytest
+
+import modelFJML
+import utilFJML
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_ZIP = os.path.join(PACKAGE_DIR, "FJTY_SVM_Models.zip")
+WORDLIST_FILE_NAME = os.path.join(PACKAGE_DIR, "demo-REUT-20-02-25-wordlists.jsonl")
+
+
+@pytest.fixture(scope="module")
+def wordlists():
+    return [rec["textInfo"]["wordlist"] for rec in utilFJML.read_file(WORDLIST_FILE_NAME)]
+
+
+@pytest.fixture(scope="module")
+def shipped(tmp_path_factory):
+    """ the vectorizer and model in FJTY_SVM_Models.zip, unpickled without upgrade_vectorizer() """
+    pytest.importorskip("sklearn")
+    dirname = tmp_path_factory.mktemp("shipped")
+    with zipfile.ZipFile(MODELS_ZIP) as fzip:
+        fzip.extractall(dirname)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")   # InconsistentVersionWarning: the pickles are from an older sklearn
+        with open(os.path.join(dirname, "FJTY_SVM_Models", "save-vectorizer-Mk2.p"), "rb") as fvec, \
+             open(os.path.join(dirname, "FJTY_SVM_Models", "save-lin_clf-Mk2.p"), "rb") as fmod:
+            return pickle.load(fvec), pickle.load(fmod), dirname
+
+
+def check_export(vectorizer, model, dirname, wordlists):
+    """ exports vectorizer and model to dirname and checks the margins and predictions of the loaded Scorer """
+    modelFJML.export_model(vectorizer, model, dirname)
+    scorer = modelFJML.load_model(dirname)
+    expected = model.decision_function(vectorizer.transform(wordlists)).reshape(len(wordlists), -1)
+    np.testing.assert_allclose(scorer.decision_function(wordlists), expected, rtol=1e-9, atol=1e-12)
+    assert (scorer.predict(wordlists) == model.predict(vectorizer.transform(wordlists))).all()
+
+
+def test_shipped_pickles(shipped, wordlists):
+    from sklearn.feature_extraction.text import CountVectorizer
+    vectorizer, model, dirname = shipped
+    assert vectorizer._tfidf.norm == "l2" and not vectorizer._tfidf.sublinear_tf
+    idf = np.asarray(vectorizer._tfidf._idf_diag.diagonal())   # the state as it was pickled
+    tfidf = CountVectorizer.transform(vectorizer, wordlists) @ vectorizer._tfidf._idf_diag
+    tfidf = tfidf.multiply(1 / np.maximum(np.sqrt(tfidf.multiply(tfidf).sum(axis=1)), 1e-300)).tocsr()
+    check_export(vectorizer, model, os.path.join(dirname, "model"), wordlists)
+    np.testing.assert_array_equal(np.load(os.path.join(dirname, "model", "idf.npy")), idf)
+    np.testing.assert_allclose(model.decision_function(vectorizer.transform(wordlists)),
+                               model.decision_function(tfidf), rtol=1e-9, atol=1e-12)
+
+
+def test_fitted_model(tmp_path, wordlists):
+    text = pytest.importorskip("sklearn.feature_extraction.text")
+    svm = pytest.importorskip("sklearn.svm")
+    labels = [len(wordlist) % 4 for wordlist in wordlists]
+    vectorizer = text.TfidfVectorizer(sublinear_tf=True)
+    model = svm.LinearSVC().fit(vectorizer.fit_transform(wordlists), labels)
+    check_export(vectorizer, model, str(tmp_path), wordlists)
+
+
+@pytest.mark.parametrize("setting", [{"strip_accents": "unicode"}, {"ngram_range": (1, 2)}, {"stop_words": "english"},
+                                     {"dtype": np.float32}, {"analyzer": "char"}])
+def test_unsupported_settings(tmp_path, wordlists, setting):
+    text = pytest.importorskip("sklearn.feature_extraction.text")
+    svm = pytest.importorskip("sklearn.svm")
+    labels = [len(wordlist) % 4 for wordlist in wordlists]
+    vectorizer = text.TfidfVectorizer(**setting)
+    model = svm.LinearSVC().fit(vectorizer.fit_transform(wordlists), labels)
+    with pytest.raises(ValueError, match=list(setting)[0]):
+        modelFJML.export_model(vectorizer, model, str(tmp_path))
@@ -6,11 +6,28 @@ This code is covered under the MIT license: http://opensource.org/licenses/MIT
 
 REVISION HISTORY:
 02-Mar-2020:	Initial version
+18-Oct-2026:	Streaming read_file for both indented PDE and one-record-per-line JSONL; optional orjson backend
+18-Oct-2026:	filter_records()
+18-Oct-2026:	AutoCoder
+18-Oct-2026:	set_coded_fields(); AutoCoder.get_index()
+18-Oct-2026:	read_file() from a byte offset; RecordIndex
+18-Oct-2026:	get_shards() and read_shard()
+18-Oct-2026:	RecordIndex.get_records(); filter_records() with a RecordIndex
+18-Oct-2026:	RecordIndex keeps the size and modification time of the file and rebuilds after any rewrite
+18-Oct-2026:	filter_records() selects by (id, occurrence) so records with duplicate ids are kept; get_case_key()
 =========================================================================================================
 """
 import datetime
 import json
 import os
+import re
+import sys
+import time
+
+try:
+    import orjson   # optional: faster JSON backend for read_file()
+except ImportError:
+    orjson = None
 
 VERSION = "0.5b1"
 CODEBOOK = "PLOVER 0.7b1"
@@ -36,6 +53,18 @@ PLOVER_CONTEXT = ["diplomatic", "legal", "military", "government", "economic", "
 
 MAX_SIZE = 3000
 
+SPACY_MODEL = "en_core_web_sm"
+SPACY_DISABLE = {"full": [],            # spaCy components that are not loaded for each extraction profile
+                 "lean": ["parser"]}    # get_wordlist() needs only the tokenizer, tagger/lemmatizer and NER
+
+JSON_BACKEND = "json"      # default read_file() backend: set to "orjson" to use orjson when it is installed
+READ_BLOCKSIZE = 1 << 16   # characters read from the file per block in read_file()
+
+JSON_DECODER = json.JSONDecoder(strict=False)  # strict=False accepts the literal tabs found in some stories
+
+INDEX_SUFFIX = ".idx"      # RecordIndex sidecar file: <filename>.idx
+WHITESPACE = re.compile(r"\s*")
+
 
 def get_timed_suffix():
     return datetime.datetime.now().strftime('%y%m%d%H%M%S')
@@ -46,12 +75,123 @@ def get_date_time():
     return datestr[0], datestr[2]
     
 
-def read_file(filename):
-    """ returns next record in a line-delimited JSON file """
+def read_file(filename, backend=None, start=0):
+    """ returns next record in a JSON file with either the indented PDE layout or one record per line, beginning at 
+    the byte offset start, which must be the start of a record (see RecordIndex). backend is "json" or "orjson"; the 
+    default is JSON_BACKEND """
+    if backend is None:
+        backend = JSON_BACKEND
+    if backend == "orjson" and orjson:
+        return read_file_orjson(filename, start)
+    else:
+        return read_file_json(filename, start)
+
+
+def read_file_json(filename, start=0):
+    """ read_file() using the incremental json.JSONDecoder.raw_decode() on a block-buffered input, so records are 
+    framed by the decoder rather than the line layout """
+    with open(filename, "r") as fin:
+        if start:
+            fin.seek(start)
+        buf, pos = "", 0
+        eof = False
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                if eof:
+                    return
+                buf, pos = fin.read(READ_BLOCKSIZE), 0
+                eof = not buf
+                continue
+            try:
+                adict, pos = JSON_DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = fin.read(max(READ_BLOCKSIZE, len(buf) - pos))  # record is incomplete: at least double the buffer
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield adict
+
+
+def read_file_orjson(filename, start=0):
+    """ read_file() using orjson; see get_record_blocks() for the framing of the records """
+    for offset, jstr in get_record_blocks(filename, start):
+        yield load_record(jstr)
+
+
+def get_record_blocks(filename, start=0):
+    """ yields the byte offset and the undecoded bytes of each record in filename from the offset start. A record is 
+    either a complete line or a block of lines ending with a '}' in the first column, which is how 
+    json.dumps(indent=2) writes the PDE files """
+    parts = []
+    with open(filename, "rb") as fin:
+        fin.seek(start)
+        offset = pos = start
+        for line in fin:
+            if not parts:
+                offset = pos
+                pos += len(line)
+                if not line.strip():
+                    continue
+                if line.rstrip().endswith(b"}"):
+                    yield offset, line
+                    continue
+            else:
+                pos += len(line)
+            parts.append(line)
+            if line.startswith(b"}"):
+                yield offset, b"".join(parts)
+                parts = []
+    if parts:
+        yield offset, b"".join(parts)
+
+
+def get_shards(filename, shard_size):
+    """ returns (start, stop) byte offsets dividing filename into shards of about shard_size bytes. Each shard begins 
+    with a line starting with '{', which is the first line of a record in both the indented PDE layout and one record
+    per line, so the shards can be found without reading the file """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as fin:
+        while bounds[-1] + shard_size < size:
+            fin.seek(bounds[-1] + shard_size)
+            pos = fin.tell() + len(fin.readline())   # skip the rest of the current line
+            line = fin.readline()
+            while line and not line.startswith(b"{"):
+                pos += len(line)
+                line = fin.readline()
+            if not line:
+                break
+            bounds.append(pos)
+    return list(zip(bounds, bounds[1:] + [size]))
+
+
+def read_shard(filename, start, stop):
+    """ returns next record in filename which begins at a byte offset in [start, stop): see get_shards() """
+    for offset, jstr in get_record_blocks(filename, start):
+        if offset >= stop:
+            return
+        yield load_record(jstr)
+
+
+def load_record(jstr):
+    """ decodes a single record with orjson, falling back on json when orjson is not installed or rejects the record 
+    (e.g. literal tabs) """
+    if orjson:
+        try:
+            return orjson.loads(jstr)
+        except orjson.JSONDecodeError:
+            pass
+    return JSON_DECODER.decode(jstr.decode("utf-8"))
+
+
+def read_file_legacy(filename):
+    """ original line-concatenating version of read_file(): retained only for the benchmark in __main__ """
     jstr = ""
     for line in open(filename, "r"):
         if line.startswith("}"):
-#            print(jstr)   # debug: uncomment to find badly formed cases, or put this into a try/except
             adict = json.loads(jstr + "}")
             yield adict
             jstr = ""
@@ -61,6 +201,292 @@ def read_file(filename):
             jstr += line[:-1].strip()
 
 
+def get_story(rec):
+    """ returns the textStory paragraphs of a PDE record as the single string that is passed to spaCy """
+    return "".join(" " + lp for lp in rec["textInfo"]["textStory"])
+
+
+def load_nlp(profile="lean"):
+    """ loads SPACY_MODEL without the components in SPACY_DISABLE[profile] """
+    import spacy   # imported here so that the programs which do not parse stories do not require spaCy
+    return spacy.load(SPACY_MODEL, disable=SPACY_DISABLE[profile])
+
+
+def get_wordlist(doc):
+    """ filters the tokens of a spaCy Doc and returns the list of remaining lemmas """
+    wlist = []
+    for token in doc:
+        if (len(token.lemma_) > 3) and \
+           (token.lemma_.isalpha()) and \
+           (token.ent_iob_ == 'O') and \
+           (not token.text[0].isupper()) and \
+            not (token.is_stop or token.is_punct or token.is_space or token.like_num):
+            wlist.append(token.lemma_)
+    return wlist
+
+
+def get_chunks(iterable, chunksize):
+    """ yields successive lists of up to chunksize items from iterable """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_case_key(recid, nseen):
+    """ returns the key (id, occurrence) of the next record with the id recid, where occurrence is the number of 
+    earlier records with that id, and counts the record in the dict nseen. Records with duplicate ids -- common in 
+    the feeds -- get distinct keys, and the k-th record with an id in a wordlist file has the same key as the k-th 
+    story with that id in the stories file the wordlists were made from """
+    occurrence = nseen.get(recid, 0)
+    nseen[recid] = occurrence + 1
+    return recid, occurrence
+
+
+def filter_records(filename, keys, index=None):
+    """ yields (key, record) for each record in filename whose key (id, occurrence) -- see get_case_key() -- is in 
+    keys, in file order, in a single pass over the file; stops reading once all of the keys have been found. If index 
+    is the RecordIndex of filename, only those records are read """
+    remaining = set(keys)
+    if index is not None:
+        nseen, found = {}, []
+        for krec, recid in enumerate(index.ids):
+            key = get_case_key(recid, nseen)
+            if key in remaining:
+                found.append((krec, key))
+        yield from zip([key for krec, key in found], index.get_records([krec for krec, key in found]))
+        return
+    nseen = {}
+    for rec in read_file(filename):
+        if not remaining:
+            return
+        key = get_case_key(rec.get("id"), nseen)
+        if key in remaining:
+            remaining.discard(key)
+            yield key, rec
+
+
+class RecordIndex:
+    """ byte offsets and ids of the records in a PDE file, so that reading can start at any record or a record can be
+    read by its id without parsing the records before it. The index is kept in the sidecar file 
+    <filename>INDEX_SUFFIX: a header line "# <size> <mtime>" with the size and modification time (nsec) of the file 
+    when it was indexed, then one line "<offset>\t<JSON id>" per record. It is built the first time the file is indexed;
+    afterwards, if the file has changed, only the records appended to the file are indexed. If the file is shorter 
+    than when it was indexed, or the first or last indexed record is no longer where the index says it is, the file has
+    been rewritten and the index is rebuilt: rebuilt is then True, and record numbers from an earlier index are no 
+    longer valid """
+
+    HEADER_FORMAT = "# {:20d} {:20d}\n"   # fixed width, so the header can be updated in place
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.indexname = filename + INDEX_SUFFIX
+        self.offsets, self.ids = [], []
+        self.size, self.mtime = 0, 0
+        self.rebuilt = False
+        if os.path.exists(self.indexname):
+            with open(self.indexname, "r") as fidx:
+                for line in fidx:
+                    if line.startswith("#"):
+                        self.size, self.mtime = [int(field) for field in line[1:].split()]
+                        continue
+                    offset, _, recid = line.partition("\t")
+                    self.offsets.append(int(offset))
+                    self.ids.append(json.loads(recid))
+            if not self.mtime:   # no header: an index without one is rebuilt
+                self.offsets, self.ids = [], []
+        self.update()
+
+    def is_valid(self, size):
+        """ returns True if the indexed records are still in the file, which now has size bytes """
+        if size < self.size:
+            return False
+        for krec in sorted({0, len(self.offsets) - 1}):
+            blocks = get_record_blocks(self.filename, self.offsets[krec])
+            block = next(blocks, None)
+            blocks.close()
+            try:
+                if not block or block[0] != self.offsets[krec] or load_record(block[1]).get("id") != self.ids[krec]:
+                    return False
+            except (ValueError, AttributeError):   # the offset is no longer the start of a record
+                return False
+        return True
+
+    def update(self):
+        """ indexes the records added to the file since the index was written, or rebuilds the index; returns the 
+        number of records added to the index """
+        stat = os.stat(self.filename)
+        nnew = 0
+        if not self.offsets or stat.st_size != self.size or stat.st_mtime_ns != self.mtime:   # the file has changed
+            nnew = self.index_records(stat)
+        self.krecs = {}   # id -> number of the first record with that id
+        for krec, recid in enumerate(self.ids):
+            self.krecs.setdefault(recid, krec)
+        return nnew
+
+    def index_records(self, stat):
+        """ indexes the records appended to the file, or all of them if the file has been rewritten; stat is the 
+        os.stat() of the file. Returns the number of records added to the index """
+        nold = len(self.offsets)
+        if nold and not self.is_valid(stat.st_size):
+            self.offsets, self.ids, nold = [], [], 0
+            self.rebuilt = True
+        if nold:
+            blocks = get_record_blocks(self.filename, self.offsets[-1])
+            next(blocks)   # the last indexed record
+        else:
+            blocks = get_record_blocks(self.filename)
+        with open(self.indexname, "r+" if nold else "w") as fidx:
+            fidx.write(self.HEADER_FORMAT.format(stat.st_size, stat.st_mtime_ns))
+            fidx.seek(0, os.SEEK_END)
+            for offset, jstr in blocks:
+                recid = load_record(jstr).get("id")
+                self.offsets.append(offset)
+                self.ids.append(recid)
+                fidx.write("{:d}\t{:s}\n".format(offset, json.dumps(recid)))
+        self.size, self.mtime = stat.st_size, stat.st_mtime_ns
+        return len(self.offsets) - nold
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_from(self, krec, backend=None):
+        """ returns next record in the file, beginning with record number krec (0-based) """
+        if krec >= len(self.offsets):
+            return iter(())
+        return read_file(self.filename, backend, self.offsets[krec])
+
+    def get_record(self, krec):
+        """ returns record number krec """
+        return next(self.read_from(krec))
+
+    def get_records(self, krecs):
+        """ yields the records numbered krecs, in the order given, reading only the bytes of those records """
+        with open(self.filename, "rb") as fin:
+            for krec in krecs:
+                fin.seek(self.offsets[krec])
+                if krec + 1 < len(self.offsets):
+                    yield load_record(fin.read(self.offsets[krec + 1] - self.offsets[krec]))
+                else:
+                    yield load_record(fin.read())
+
+    def get_record_by_id(self, recid):
+        """ returns the first record with the id recid, or None """
+        krec = self.krecs.get(recid)
+        return None if krec is None else self.get_record(krec)
+
+
+def get_story_prefix(rec, nchar):
+    """ returns the first nchar characters of " ".join(rec["textInfo"]["textStory"]) without joining the rest of the
+    story """
+    paras, length = [], -1
+    for para in rec["textInfo"]["textStory"]:
+        paras.append(para)
+        length += len(para) + 1
+        if length >= nchar:
+            break
+    return " ".join(paras)[:nchar]
+
+
+def get_phrase_regex(phrases):
+    """ returns a regex matching any of phrases, with the phrases merged into a trie so that the regex engine tests a
+    single character at each branch rather than every phrase in turn. At each position the longest phrase is matched """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = True   # end of a phrase
+
+    def get_branch(node):
+        alts = [re.escape(ch) + get_branch(node[ch]) for ch in sorted(node) if ch]
+        if not alts:
+            return ""
+        regex = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            return "(?:" + regex + ")?" if len(alts) == 1 and len(regex) > 1 else regex + "?"
+        return regex
+
+    return get_branch(trie)
+
+
+class AutoCoder:
+    """ phrase matcher for the autocoding files of FJTYFilt-plovigy.py. Each line of the file is
+
+        <mode#>-<mode_text>: [<window>:] <comma delimited list of phrases>
+
+    and a story gets the mode of the first list with a phrase in the first <window> characters of the story (default:
+    window). All of the phrases are matched in a single pass over the start of the story by one compiled regex; see
+    get_phrase_regex() """
+
+    def __init__(self, filename, window=256):
+        self.lists = []   # (mode, window, phrases) in file order
+        self.linenos = []   # line number in filename of each list: blank lines are skipped
+        with open(filename, "r") as fin:
+            for lineno, line in enumerate(fin, 1):
+                mode, _, rest = line.rstrip("\n").partition(":")
+                if not mode.strip():
+                    continue
+                part = rest.partition(":")
+                if part[1] and part[0].strip().isdigit():
+                    listwindow, rest = int(part[0]), part[2]
+                else:
+                    listwindow = window
+                self.lists.append((mode.strip(), listwindow, [ph.strip() for ph in rest.split(",") if ph.strip()]))
+                self.linenos.append(lineno)
+        self.maxwindow = max([lst[1] for lst in self.lists] + [0])
+        phrases = sorted({ph for lst in self.lists for ph in lst[2]})
+        # the regex finds the longest phrase starting at each position; the shorter phrases starting there are its
+        # prefixes, so hits[phrase] lists (length, klist, window) for every list containing the phrase or a prefix
+        # of it, in list order
+        self.hits = {}
+        for phrase in phrases:
+            self.hits[phrase] = sorted(((len(ph), klist, lst[1]) for klist, lst in enumerate(self.lists)
+                                        for ph in lst[2] if phrase.startswith(ph)), key=lambda hit: (hit[1], hit[0]))
+        self.pattern = re.compile("(?=(" + get_phrase_regex(phrases) + "))") if phrases else None
+
+    def get_index(self, text):
+        """ returns the index in self.lists of the first list with a phrase in its window of text, or None """
+        if not self.pattern:
+            return None
+        best = len(self.lists)
+        for match in self.pattern.finditer(text, 0, self.maxwindow):
+            start = match.start()
+            for nchar, klist, window in self.hits[match.group(1)]:
+                if klist >= best:
+                    break
+                if start + nchar <= window:
+                    best = klist
+                    break
+            if best == 0:
+                break
+        return best if best < len(self.lists) else None
+
+    def get_mode(self, text):
+        """ returns the mode of the first list with a phrase in its window of text, or None """
+        klist = self.get_index(text)
+        return None if klist is None else self.lists[klist][0]
+
+    def get_record_index(self, rec):
+        """ get_index() for the story in a PDE record """
+        return self.get_index(get_story_prefix(rec, self.maxwindow))
+
+    def get_record_mode(self, rec):
+        """ returns the mode of the story in a PDE record, or None """
+        return self.get_mode(get_story_prefix(rec, self.maxwindow))
+
+
+def set_coded_fields(record, parser, coder):
+    """ sets the fields recording how and by whom the mode of a PDE record was coded """
+    record["citeInfo"]['parser'] = parser
+    record['codedDate'], record['codedTime'] = get_date_time()
+    record['coder'] = coder
+
+
 def read_dictionary(thedict, filename):
     print("Initializing from", filename)
     reader = read_file(filename)
@@ -101,3 +527,18 @@ def read_newphrase(actordict, filename):
     os.remove("newphrase.scr.jsonl")
 
 
+if __name__ == "__main__":
+    # read_file() throughput benchmark: python3 utilFJML.py [filenames]; defaults to the sample files
+    filenames = sys.argv[1:] or ["demo-REUT-20-02-25-wordlists.jsonl", "REUT-20-02-25-wordlists.jsonl"]
+    readers = [("legacy", read_file_legacy), ("json", read_file_json)]
+    if orjson:
+        readers.append(("orjson", read_file_orjson))
+    for filename in filenames:
+        nbytes = os.path.getsize(filename)
+        print(filename, "{:,d} bytes".format(nbytes))
+        for name, reader in readers:
+            t0 = time.time()
+            nrec = sum(1 for rec in reader(filename))
+            dt = max(time.time() - t0, 1e-9)
+            print("  {:>8s}: {:6d} records  {:8.3f} sec  {:10.0f} records/sec  {:8.2f} MB/sec".format(
+                name, nrec, dt, nrec/dt, nbytes/dt/1e6))